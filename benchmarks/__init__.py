@@ -0,0 +1,18 @@
+"""
+	Benchmarks of makeCourse
+
+	A synthetic course (of configurable size) is generated, with stub sessions (see sessions.py) and a fake pdflatex,
+	and the builds are timed in fresh processes: cold build, warm no-op build, and incremental build after a single edit.
+
+	Usage (from the root of the repository):
+		python -m benchmarks.run --sessions 20 --exercises 10 --output results-new.json
+		python -m benchmarks.run --makecourse /path/to/another/checkout --label v0.5 --output results-old.json
+		python -m benchmarks.compare results-old.json results-new.json
+
+	The publication to Wordpress is benchmarked against a stub server (see wpserver.py):
+		python -m benchmarks.publish --posts 30 --latency 0.05 --jobs 1,4,8
+
+	The generated course can also be kept and built by hand:
+		python -m benchmarks.generate /tmp/course --sessions 50
+		cd /tmp/course && PATH=$PWD/bin:$PATH python course.py -v1
+"""
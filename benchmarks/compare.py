@@ -0,0 +1,45 @@
+"""
+	Compare the results of several benchmark runs (JSON files written by run.py --output), for instance of several versions
+	The median times are displayed for each scenario, with their ratio to the first file
+	Usage: python -m benchmarks.compare results-old.json results-new.json ...
+"""
+
+import sys
+import json
+
+from .run import scenarios
+
+
+def compare( results):
+	"""Display the median times and peak memory of the results, relative to the first one"""
+	first = results[0]
+	same = lambda p: { k: v for k, v in p.items() if k != 'repeat' }
+	for r in results[1:]:
+		if same( r['parameters']) != same( first['parameters']):
+			print( "Warning: %s and %s were not run with the same parameters" % (first['label'], r['label']) )
+	width = max( 12, max( len(r['label']) for r in results) )
+	print( "%-12s " % 'scenario' + ' '.join( r['label'].rjust(width) for r in results) )
+	for s in scenarios:
+		reference = first['scenarios'][s]['median']
+		cells = []
+		for r in results:
+			t = r['scenarios'][s]['median']
+			cells.append( ('%.3fs' % t if r is first else '%.3fs x%.2f' % (t, t/reference if reference else 0)).rjust(width) )
+		print( "%-12s " % s + ' '.join( cells) )
+	print( "%-12s " % 'peak (MB)' + ' '.join( ('%.1f' % (max( r['scenarios'][s]['maxrss'] for s in scenarios)/1024)).rjust(width) for r in results) )
+
+
+def main( files):
+	if not files:
+		print( "Usage: python -m benchmarks.compare results.json...")
+		return 1
+	results = []
+	for fileName in files:
+		with open( fileName) as f:
+			results.append( json.load(f))
+	compare( results)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit( main( sys.argv[1:]))
@@ -0,0 +1,51 @@
+"""
+	Fake pdflatex, used by the generated courses (their bin/pdflatex calls it)
+
+	It accepts the options used by makeCourse (-ini, -jobname=, -fmt=, -interaction=, etc.), writes the .pdf (a copy of
+	the source), .aux and .log files, and waits BENCH_LATEX_DELAY seconds (0 by default) to model the cost of a compilation
+"""
+
+import os
+import sys
+import time
+
+
+def main( args):
+	ini = False
+	jobName = None
+	texFile = None
+	for a in args:
+		if a in ('-ini', '--ini'):
+			ini = True
+		elif a.startswith('-jobname='):
+			jobName = a[len('-jobname='):]
+		elif a.startswith('-'):
+			pass
+		else:
+			texFile = a
+	if texFile is None:
+		print( "fake pdflatex: no file given")
+		return 1
+	texFile = texFile.lstrip('&*')
+	base = jobName or os.path.splitext(texFile)[0]
+
+	time.sleep( float( os.environ.get('BENCH_LATEX_DELAY', 0) ) )
+	print( "This is fake pdfTeX")
+	if ini:
+		# precompiled preamble (see --precompile)
+		with open( base+'.fmt', 'w') as f:
+			f.write( "format of " + texFile + "\n")
+		return 0
+	with open( texFile, 'rb') as f:
+		source = f.read()
+	with open( base+'.pdf', 'wb') as f:
+		f.write( b'%PDF-1.4\n' + source)
+	with open( base+'.aux', 'w') as f:
+		f.write( "\\relax\n")
+	with open( base+'.log', 'w') as f:
+		f.write( "Output written on " + base + ".pdf\n")
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit( main( sys.argv[1:]))
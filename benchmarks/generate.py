@@ -0,0 +1,148 @@
+"""
+	Generator of synthetic courses (for the benchmarks)
+
+	A course is made of TDs (each one with its own exercises, imported through nested parts) and lectures, with
+	attributes used by the templates and contents in markdown (converted by pandoc) or in LaTeX
+	The generation is deterministic (for the same parameters and seed)
+"""
+
+import os
+import sys
+import stat
+import random
+from optparse import OptionParser
+
+
+# default parameters of the course
+defaults = {
+	'sessions': 10,			# number of TDs
+	'lectures': 2,			# number of lectures (CM)
+	'exercises': 5,			# number of exercises per TD
+	'depth': 1,				# import depth (number of nested parts between a TD and its exercises)
+	'fanout': 4,			# number of attributes per exercise (used by the template) and on the course
+	'markdown': 0.5,		# ratio of the contents written in markdown (the others are in LaTeX)
+	'paragraphs': 3,		# number of paragraphs per exercise
+	'seed': 0
+}
+
+_words = "algorithm graph tree list stack queue heap sort search complexity recursion loop invariant proof array hash table pointer memory".split()
+
+
+def _text( rng, markdown, paragraphs):
+	"""Return some random text, in markdown or LaTeX"""
+	lines = []
+	for p in range( paragraphs):
+		words = [ rng.choice(_words) for _ in range(30) ]
+		i = rng.randrange( len(words) )
+		if markdown:
+			words[i] = '*' + words[i] + '*'
+			lines.append( ' '.join(words) + '.\n\n- first item\n- second `item`\n')
+		else:
+			words[i] = r'\emph{' + words[i] + '}'
+			lines.append( ' '.join(words) + '.\n\\begin{itemize}\\item first item \\item second \\texttt{item}\\end{itemize}\n')
+	return '\n'.join( lines)
+
+
+def _write( path, content):
+	os.makedirs( os.path.dirname(path) or '.', exist_ok=True)
+	with open( path, 'w', encoding='utf-8') as f:
+		f.write( content)
+
+
+def exerciseFile( course, td, ex):
+	"""Return the path (relative to the course) of an exercise (used to edit one, see run.py)"""
+	return os.path.join( course, 'exos', 'ex%03d_%02d.xml' % (td, ex) )
+
+
+def generateCourse( path, sessions=10, lectures=2, exercises=5, depth=1, fanout=4, markdown=0.5, paragraphs=3, seed=0):
+	"""Generate a synthetic course in the directory path: the course file (course.xml), the imported files, the templates,
+	the script that builds it (course.py, with the stub sessions of sessions.py) and the fake pdflatex (bin/pdflatex)
+	Returns the number of files generated"""
+	rng = random.Random( seed)
+	files = 0
+
+	# templates
+	attrs = [ 'a%d' % i for i in range(fanout) ]
+	_write( os.path.join( path, 'commonFiles', 'TD', 'TD.tex'),
+		"\\documentclass{article}\n\\usepackage{tdtme}\n\\title{ {{<name>}} }\n\\begin{document}\n{{<Enseignants>}}\n{{<Content>}}\n\\end{document}\n")
+	_write( os.path.join( path, 'commonFiles', 'TD', 'tdtme.sty'), "% {{<title>}} {{<year>}}\n")
+	_write( os.path.join( path, 'commonFiles', 'TD', 'exo.tex'),
+		"\\section{ {{<titre>}} }\n" + ''.join( "%% {{<%s>}}\n" % a for a in attrs) + "{{<Content>}}\n")
+	_write( os.path.join( path, 'commonFiles', 'CM', 'CM.tex'),
+		"{{<documentclass>}}\n\\title{ {{<title>}} {{<name>}} }\n\\begin{document}\n{{<Content>}}\n\\end{document}\n")
+	files += 4
+
+	# exercises, and the parts that import them
+	tds = []
+	for td in range( sessions):
+		imports = []
+		for ex in range( exercises):
+			md = rng.random() < markdown
+			attributes = ''.join( ' %s="%s %d"' % (a, rng.choice(_words), rng.randrange(100)) for a in attrs)
+			_write( exerciseFile( path, td, ex),
+				'<BenchExercice titre="Exercise %d.%d" lang="%s"%s>\n%s\n</BenchExercice>\n' % (td, ex, 'markdown' if md else 'latex', attributes, _text( rng, md, paragraphs)) )
+			imports.append( '<BenchExercice import="ex%03d_%02d"/>' % (td, ex) )
+			files += 1
+		body = '\n\t\t'.join( imports)
+		for level in reversed( range( depth)):
+			name = 'part%03d_%d' % (td, level)
+			_write( os.path.join( path, 'parts', name+'.xml'), '<Part level="%d">\n\t\t%s\n</Part>\n' % (level, body) )
+			body = '<Part import="%s"/>' % name
+			files += 1
+		md = rng.random() < markdown
+		# (the text is not indented, an indented markdown is a code block)
+		tds.append( '\t<BenchTD title="TD %d" lang="%s">\n\t\t%s\n%s\n\t</BenchTD>' % (td, 'markdown' if md else 'latex', body, _text( rng, md, 1)) )
+
+	cms = [ '\t<BenchCM title="Lecture %d" lang="latex">\n\\begin{frame}\n%s\n\\end{frame}\n\t</BenchCM>' % (cm, _text( rng, False, paragraphs)) for cm in range( lectures) ]
+	attributes = ''.join( ' %s="%s"' % (a, rng.choice(_words)) for a in attrs)
+	_write( os.path.join( path, 'course.xml'), '<Course year="2026" title="Benchmark"%s>\n%s\n</Course>\n' % (attributes, '\n'.join( tds + cms)) )
+	files += 1
+
+	# script building the course (makeCourse is taken from BENCH_MAKECOURSE, if given, so that several versions can be compared)
+	_write( os.path.join( path, 'course.py'), '''import os
+import sys
+sys.path.insert( 0, os.environ.get('BENCH_MAKECOURSE', %r) )
+sys.path.insert( 1, %r )
+from makeCourse.makeCourse import makeCourse
+from benchmarks.sessions import *
+
+makeCourse( 'course.xml', 'out/{name}/', {'BenchExercice': 'exos/', 'Part': 'parts/'}, {'BenchTD': 'commonFiles/TD/', 'BenchExercice': 'commonFiles/TD/', 'BenchCM': 'commonFiles/CM/'})
+''' % (_root(), _root()) )
+
+	# fake pdflatex
+	latex = os.path.join( path, 'bin', 'pdflatex')
+	_write( latex, '#!/bin/sh\nexec %s %s "$@"\n' % (sys.executable, os.path.join( _root(), 'benchmarks', 'fakelatex.py')) )
+	os.chmod( latex, os.stat(latex).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+	return files + 2
+
+
+def _root():
+	"""Root of the repository (where makeCourse and benchmarks are)"""
+	return os.path.dirname( os.path.dirname( os.path.abspath(__file__)))
+
+
+def addOptions( parser):
+	"""Add the options of the course parameters to the (optparse) parser"""
+	parser.add_option('--sessions', help='Number of TDs', type=int, default=defaults['sessions'])
+	parser.add_option('--lectures', help='Number of lectures', type=int, default=defaults['lectures'])
+	parser.add_option('--exercises', help='Number of exercises per TD', type=int, default=defaults['exercises'])
+	parser.add_option('--depth', help='Import depth (nested parts between a TD and its exercises)', type=int, default=defaults['depth'])
+	parser.add_option('--fanout', help='Number of attributes per exercise', type=int, default=defaults['fanout'])
+	parser.add_option('--markdown', help='Ratio of the contents in markdown (the others are in LaTeX)', type=float, default=defaults['markdown'])
+	parser.add_option('--paragraphs', help='Number of paragraphs per exercise', type=int, default=defaults['paragraphs'])
+	parser.add_option('--seed', help='Seed of the random generator', type=int, default=defaults['seed'])
+
+
+def parameters( options):
+	"""Return the course parameters given by the options"""
+	return { k: getattr( options, k) for k in defaults }
+
+
+if __name__ == '__main__':
+	parser = OptionParser( usage="python -m benchmarks.generate [options] directory")
+	addOptions( parser)
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error( "the directory of the course is required")
+	n = generateCourse( args[0], **parameters(options))
+	print( "%d files generated in %s" % (n, args[0]) )
@@ -0,0 +1,28 @@
+"""
+	Run a command (in a fresh process) and print, as JSON, its duration, its return code and its peak memory
+	(the maximum resident set size of the command, in kB)
+	Usage: python -m benchmarks.measure log-file command...
+	(the outputs of the command are written in log-file)
+"""
+
+import sys
+import json
+import time
+import resource
+import subprocess
+
+
+def main( args):
+	logFile, cmd = args[0], args[1:]
+	with open( logFile, 'w') as log:
+		start = time.perf_counter()
+		returncode = subprocess.call( cmd, stdout=log, stderr=subprocess.STDOUT)
+		duration = time.perf_counter() - start
+	maxrss = resource.getrusage( resource.RUSAGE_CHILDREN).ru_maxrss
+	if sys.platform == 'darwin':
+		maxrss //= 1024		# (in bytes on macOS)
+	print( json.dumps( {'time': duration, 'returncode': returncode, 'maxrss': maxrss}) )
+
+
+if __name__ == '__main__':
+	main( sys.argv[1:])
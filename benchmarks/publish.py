@@ -0,0 +1,61 @@
+"""
+	Benchmark of the publication of posts to Wordpress, against the stub server (see wpserver.py)
+	Some posts are already online (they are updated), the others are created; the time, the number of requests
+	and the number of connections are displayed for each number of jobs, and the time and number of requests
+	to publish them again when they have not changed (they are skipped)
+	Usage: python -m benchmarks.publish --posts 30 --latency 0.05 --jobs 1,4,8
+"""
+
+import io
+import time
+from contextlib import redirect_stdout
+from optparse import OptionParser, Values
+
+from makeCourse.config import Config
+from makeCourse import wordpress
+from .wpserver import WPServer
+
+
+def publishAll( posts, online, latency, jobs):
+	"""Publish posts posts (online of them being already online) with a new client, then publish them again (unchanged)
+	with another client, and return the times, the numbers of requests and the number of connections"""
+	server = WPServer( latency).start()
+	try:
+		for i in range( online):
+			server.addPost( 'TP%d' % (i+1), 'old content', 'bench')
+		wordpress._sessions.clear()
+		wordpress._published._memory.clear()
+		measures = []
+		for run in range(2):
+			wp = wordpress.WP( server.url, 'user', 'password')
+			for i in range( posts):
+				wp.publish( 'TP%d' % (i+1), '<p>content of TP%d</p>' % (i+1), 'bench')
+			before = sum( server.requests.values())
+			start = time.perf_counter()
+			with redirect_stdout( io.StringIO()):
+				published = wp.flush( jobs)
+			measures.extend( [time.perf_counter() - start, sum( server.requests.values()) - before] )
+			assert len(published) == (posts if run == 0 else 0) and len(server.posts) == max( posts, online), "some posts have not been published"
+		return measures + [server.connections]
+	finally:
+		server.stop()
+
+
+def main():
+	parser = OptionParser( usage="python -m benchmarks.publish [options]")
+	parser.add_option('--posts', help='Number of posts to publish', type=int, default=30)
+	parser.add_option('--online', help='Number of posts already online (updated)', type=int, default=20)
+	parser.add_option('--latency', help='Time (in seconds) of each request to the stub server', type=float, default=0.05)
+	parser.add_option('--jobs', help='Numbers of posts published at the same time (comma-separated)', default='1,4,8')
+	options, args = parser.parse_args()
+
+	print( "%d posts (%d online), latency %.0f ms" % (options.posts, options.online, 1000*options.latency) )
+	print( "  %6s %10s %10s %12s %14s %10s" % ('jobs', 'time (s)', 'requests', 'connections', 'unchanged (s)', 'requests') )
+	for jobs in [ int(j) for j in options.jobs.split(',') ]:
+		Config.options = Values( {'verbosity': 0, 'wpJobs': jobs} )
+		duration, requests, again, againRequests, connections = publishAll( options.posts, options.online, options.latency, jobs)
+		print( "  %6d %10.3f %10d %12d %14.3f %10d" % (jobs, duration, requests, connections, again, againRequests) )
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,137 @@
+"""
+	Run the benchmarks on a synthetic course: cold build, warm no-op build and incremental build after a single edit
+	Each build runs in a fresh process (see measure.py); the times (median and min over the repetitions), the peak memory
+	and the number of sessions built are displayed, and written as JSON with --output (see compare.py to compare them)
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import shutil
+import platform
+import tempfile
+import subprocess
+from statistics import median
+from optparse import OptionParser
+
+from .generate import generateCourse, exerciseFile, addOptions, parameters, _root
+
+
+scenarios = ('cold', 'noop', 'incremental')
+
+
+def version( path):
+	"""Return the version (git describe) of the makeCourse in path"""
+	try:
+		return subprocess.check_output( ['git', '-C', path, 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return 'unknown'
+
+
+def clean( course):
+	"""Remove everything produced by the previous builds (outputs, state and caches)"""
+	for d in ('out', 'debug', '.makeCourse-cache'):
+		shutil.rmtree( os.path.join( course, d), ignore_errors=True)
+	if os.path.exists( os.path.join( course, '.course.xml.makeCourse')):
+		os.remove( os.path.join( course, '.course.xml.makeCourse'))
+
+
+def edit( course, n):
+	"""Make a small edit to one exercise (of the first TD)"""
+	fileName = exerciseFile( course, 0, 0)
+	with open( fileName, encoding='utf-8') as f:
+		content = f.read()
+	content = re.sub( r'(edited \d+\n)?</BenchExercice>', 'edited %d\n</BenchExercice>' % n, content)
+	with open( fileName, 'w', encoding='utf-8') as f:
+		f.write( content)
+
+
+def build( course, args, env):
+	"""Build the course (in a fresh process), and return its measures (time, peak memory and number of sessions built)"""
+	logFile = os.path.join( course, 'build.log')
+	out = subprocess.check_output( [sys.executable, '-m', 'benchmarks.measure', logFile, sys.executable, 'course.py'] + args, cwd=course, env=env)
+	result = json.loads( out.decode().splitlines()[-1])
+	with open( logFile, encoding='utf-8', errors='replace') as f:
+		log = f.read()
+	if result['returncode'] != 0 or 'Traceback' in log:
+		sys.stdout.write( log[-2000:])
+		raise RuntimeError( "The build of the course failed (see " + logFile + ")")
+	result['built'] = len( re.findall( r'\*\) Make ', log))
+	return result
+
+
+def runBenchmarks( course, repeat=3, args=(), makecourse=None, latexDelay=0.0, verbose=False):
+	"""Run the scenarios repeat times on the course, and return the measures of each scenario"""
+	env = dict( os.environ)
+	env['PATH'] = os.path.join( course, 'bin') + os.pathsep + env.get('PATH', '')
+	env['PYTHONPATH'] = _root() + (os.pathsep + env['PYTHONPATH'] if env.get('PYTHONPATH') else '')
+	env['BENCH_LATEX_DELAY'] = str( latexDelay)
+	if makecourse:
+		env['BENCH_MAKECOURSE'] = os.path.abspath( makecourse)
+	measures = { s: [] for s in scenarios }
+	for r in range( repeat):
+		clean( course)
+		measures['cold'].append( build( course, list(args), env) )
+		measures['noop'].append( build( course, list(args), env) )
+		edit( course, r)
+		measures['incremental'].append( build( course, list(args), env) )
+		if verbose:
+			print( "run %d: " % (r+1) + ", ".join( "%s %.2fs" % (s, measures[s][-1]['time']) for s in scenarios ) )
+	return {
+		s: {
+			'times': [ m['time'] for m in measures[s] ],
+			'median': median( m['time'] for m in measures[s] ),
+			'min': min( m['time'] for m in measures[s] ),
+			'maxrss': max( m['maxrss'] for m in measures[s] ),
+			'built': measures[s][-1]['built']
+		} for s in scenarios
+	}
+
+
+def display( result):
+	"""Display the measures of a run"""
+	print( "%s (%s)" % (result['label'], ', '.join( '%s=%s' % kv for kv in sorted( result['parameters'].items() ) )) )
+	print( "  %-12s %10s %10s %12s %8s" % ('scenario', 'median (s)', 'min (s)', 'peak (MB)', 'built') )
+	for s in scenarios:
+		m = result['scenarios'][s]
+		print( "  %-12s %10.3f %10.3f %12.1f %8d" % (s, m['median'], m['min'], m['maxrss']/1024, m['built']) )
+
+
+def main():
+	parser = OptionParser( usage="python -m benchmarks.run [options]")
+	addOptions( parser)
+	parser.add_option('--repeat', help='Number of repetitions of each scenario', type=int, default=3)
+	parser.add_option('--args', help='Options given to makeCourse (ex: "-j4 -p")', default='')
+	parser.add_option('--makecourse', help='Path of the makeCourse to benchmark (a checkout of another version), this one by default', default=None)
+	parser.add_option('--label', help='Label of the results (by default, the version of makeCourse)', default=None)
+	parser.add_option('--latex-delay', help='Time (in seconds) spent by each call to the fake pdflatex', dest='latexDelay', type=float, default=0.0)
+	parser.add_option('--course', help='Directory where the course is generated (kept), a temporary one by default', default=None)
+	parser.add_option('-o', '--output', help='Write the results (JSON) in OUTPUT', default=None)
+	parser.add_option('-v', '--verbose', help='Display the times of each repetition', default=False, action='store_true')
+	options, args = parser.parse_args()
+
+	course = options.course or tempfile.mkdtemp( prefix='mkc-bench-')
+	try:
+		generateCourse( course, **parameters(options))
+		result = {
+			'label': options.label or version( options.makecourse or _root()),
+			'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'parameters': dict( parameters(options), args=options.args, latexDelay=options.latexDelay, repeat=options.repeat),
+			'scenarios': runBenchmarks( course, options.repeat, shlex.split(options.args), options.makecourse, options.latexDelay, options.verbose)
+		}
+	finally:
+		if not options.course:
+			shutil.rmtree( course, ignore_errors=True)
+	display( result)
+	if options.output:
+		with open( options.output, 'w') as f:
+			json.dump( result, f, indent=1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,72 @@
+"""
+	Stub sessions of the synthetic course (modeled on makeCourse/examples.py)
+
+	They render their templates like the CM, TD and Exercice of the examples, but pdflatex is the fake one of the
+	generated course (see fakelatex.py)
+	They only rely on writeFileFromTemplate, getStringFromTemplate and runCommand, and use the newer methods
+	(variants, prefetched conversions, memoized renders) when they exist, so that older versions can be benchmarked too
+"""
+
+from makeCourse.Session import Session
+from makeCourse.osUtils import runCommand
+
+
+# (keyword arguments only understood by the newer versions)
+_memoize = {'memoize': True} if 'memoize' in Session.getStringFromTemplate.__code__.co_varnames else {}
+
+
+def compileTeX( session, name, texFile, passes=2):
+	"""Compile the LaTeX file (as a variant when the variants exist, ie at the same time as the other ones)"""
+	if hasattr( session, 'addVariant'):
+		session.addVariant( name, texFile, passes)
+	else:
+		runCommand( ['pdflatex', '-interaction=nonstopmode', texFile], passes)
+
+
+def exercises( tag):
+	"""Return the exercises of the tag and of its children (recursively, in order: they are nested in the parts)"""
+	for t in tag.children:
+		if t.tag.name == 'BenchExercice':
+			yield t
+		else:
+			yield from exercises( t)
+
+
+class BenchCM(Session):
+	"""Stub lecture (slides and handout)"""
+
+	def make(self, options):
+		self.writeFileFromTemplate( 'CM.tex', self.name+'.tex', {'documentclass': r'\documentclass{beamer}'}, lang='latex')
+		compileTeX( self, 'slides', self.name+'.tex')
+		self.writeFileFromTemplate( 'CM.tex', self.name+'-handout.tex', {'documentclass': r'\documentclass[handout]{beamer}'}, lang='latex')
+		compileTeX( self, 'handout', self.name+'-handout.tex')
+
+	def files(self, options):
+		return [ self.name+'.pdf', self.name+'-handout.pdf']
+
+
+
+class BenchTD(Session):
+	"""Stub TD (student and teacher versions, with the exercises)"""
+
+	def make(self, options):
+		self.writeFileFromTemplate( 'tdtme.sty', 'tdtme.sty')
+		if hasattr( self, 'prefetchConversions'):
+			self.prefetchConversions('latex')
+		Content = '\n'.join( e.LaTeX() for e in exercises(self) ) + self.dict["Content"].convertTo(lang='latex')
+		self.writeFileFromTemplate( 'TD.tex', self.name+'-eleves.tex', {'Enseignants': '', 'Content': Content}, lang='latex')
+		compileTeX( self, 'eleves', self.name+'-eleves.tex')
+		self.writeFileFromTemplate( 'TD.tex', self.name+'-enseignants.tex', {'Enseignants': '[enseignants]', 'Content': Content}, lang='latex')
+		compileTeX( self, 'enseignants', self.name+'-enseignants.tex')
+
+	def files(self, options):
+		return [ self.name+'-eleves.pdf', self.name+'-enseignants.pdf']
+
+
+
+class BenchExercice(Session):
+	"""Stub exercise"""
+	__slots__ = ()
+
+	def LaTeX(self):
+		return self.getStringFromTemplate( 'exo.tex', lang='latex', **_memoize)
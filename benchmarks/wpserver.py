@@ -0,0 +1,101 @@
+"""
+	Stub Wordpress server (JSON API and JSON API Auth plugins), to test and benchmark the publication of the posts
+	without a real site
+	Only the methods used by makeCourse.wordpress are implemented; each request waits `latency` seconds (to model
+	the round trips to a real site), and the requests received are counted
+"""
+
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class WPServer(ThreadingHTTPServer):
+	"""Stub Wordpress server, run in a thread (see start and stop)"""
+	daemon_threads = True
+
+	def __init__(self, latency=0.0, port=0):
+		super().__init__( ('127.0.0.1', port), _Handler)
+		self.latency = latency
+		self.posts = {}			# id -> post (dictionary with id, title, content, categories and modified)
+		self.requests = {}		# number of requests received, per method
+		self.connections = 0	# number of connections opened by the clients
+		self.lock = threading.Lock()
+		self._thread = None
+
+	@property
+	def url(self):
+		return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+	def start(self):
+		self._thread = threading.Thread( target=self.serve_forever, daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+	def addPost(self, title, content, category):
+		"""Add a post (already online)"""
+		with self.lock:
+			id = len(self.posts) + 1
+			self.posts[id] = {'id': id, 'title': title, 'content': content, 'categories': category, 'modified': time.strftime('%Y-%m-%d %H:%M:%S')}
+		return id
+
+	def answer(self, params):
+		"""Return the answer to the request (the parameters of the query)"""
+		method = params.get('json', '')
+		with self.lock:
+			self.requests[method] = self.requests.get(method, 0) + 1
+		if method == 'get_nonce':
+			return {'status': 'ok', 'controller': params.get('controller'), 'method': params.get('method'), 'nonce': 'nonce-' + str(params.get('method'))}
+		if params.get('nonce') != 'nonce-' + method.split('.')[-1]:
+			return {'status': 'error', 'error': "Your 'nonce' value was incorrect. Use the 'get_nonce' API method."}
+		if method == 'auth.generate_auth_cookie':
+			return {'status': 'ok', 'cookie': 'cookie-' + str(params.get('username'))}
+		if params.get('cookie') is None:
+			return {'status': 'error', 'error': "You must include a 'cookie' var in your request."}
+		if method == 'get_posts':
+			count, page = int( params.get('count', 10)), int( params.get('page', 1))
+			with self.lock:
+				posts = [ p for p in self.posts.values() if p['categories'] == params.get('category_name') ]
+			return {'status': 'ok', 'count': len(posts[(page-1)*count:page*count]), 'count_total': len(posts), 'pages': (len(posts)+count-1)//count,
+			        'posts': posts[(page-1)*count:page*count]}
+		if method == 'create_post':
+			id = self.addPost( params.get('title'), params.get('content'), params.get('categories'))
+			return {'status': 'ok', 'post': self.posts[id]}
+		if method == 'update_post':
+			with self.lock:
+				post = self.posts.get( int(params.get('id', 0)) )
+				if post is None:
+					return {'status': 'error', 'error': "Post not found."}
+				post.update( title=params.get('title'), content=params.get('content'), modified=time.strftime('%Y-%m-%d %H:%M:%S'))
+			return {'status': 'ok', 'post': post}
+		return {'status': 'error', 'error': "Unknown method '" + method + "'."}
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'		# (keep-alive connections)
+	disable_nagle_algorithm = True
+
+	def setup(self):
+		super().setup()
+		with self.server.lock:
+			self.server.connections += 1
+
+	def do_GET(self):
+		params = { k: v[-1] for k, v in parse_qs( urlparse(self.path).query, keep_blank_values=True).items() }
+		time.sleep( self.server.latency)
+		body = json.dumps( self.server.answer( params)).encode()
+		self.send_response( 200)
+		self.send_header( 'Content-Type', 'application/json')
+		self.send_header( 'Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write( body)
+
+	def log_message(self, *args):
+		pass
@@ -9,65 +9,371 @@
 
 
 
-from bs4 import Comment, NavigableString
 import io
-import jinja2
-from jinja2 import meta
 import os
-import time
+import platform
+from glob import glob
 from hashlib import md5
 from colorama import Fore, Style
 import datetime
-from .osUtils import runCommand, getPathTime, splitToComma, fileAlmostExists
+import threading
+from functools import lru_cache
+from collections import ChainMap
+from collections.abc import Mapping
+from . import osUtils
+from .osUtils import runCommand, runLaTeX, display, stageFiles, splitToComma, fileAlmostExists, workPath, fileHash, toolIdentity
 from .config import Config
 
 from .mkcException import mkcException
-from bs4 import BeautifulSoup
+from .xmlTree import Node, Comment, parseFile
 import codecs
 
-from .StrLang import StrLang
-
+from .StrLang import StrLang, convertAll, pandocIdentity, pandocVersion
+from .cache import Cache, hashKey
+from . import profiling
+from .profiling import span
+import time
 
-def createTagSession( tag, father):
-	"""take a beautifulsoup tag and return a Tag object or a Session object, according to the name"""
-	return Config.allSessions.get( tag.name, Tag)( tag, father)
 
+_latexOutputs = Cache('latex')		# pdf produced by the LaTeX compilations (key: source, other rendered files, resources, tools)
+_formats = Cache('formats')			# precompiled preambles (key: preamble, .sty/.cls files, tool)
+_failedFormats = set()				# keys of the preambles that cannot be precompiled
+importedFiles = set()				# files imported by the trees of the course (watched in watch mode, even when a build fails)
+_formatsLock = threading.Lock()		# the variants of a session share their precompiled preamble (it is built only once)
 
 
-# jinja renderer (change the default delimiters used by Jinja such that it won't pick up brackets attached to LaTeX macros.)
-# cfhttp://tex.stackexchange.com/questions/40720/latex-in-industry
-renderer = jinja2.Environment(
+def createTagSession( tag, father):
+	"""take a node (of the XML tree) and return a Tag object or a Session object, according to the name
+	(or None for a session that is not selected on the command line, see skipSession)"""
+	cls = Config.allSessions.get( tag.name, Tag)
+	if Config.selection is not None and 'make' in cls.__dict__ and skipSession( tag, father, cls):
+		return None
+	return cls( tag, father)
+
+
+def mayBeSelected( typ, name):
+	"""True if the node of a session (of type typ, and with the attribute name) may be selected by the arguments of the command line (by its type or its name)"""
+	return typ in Config.selection or (name in Config.selection if name else any( a.startswith(typ) for a in Config.selection ))
+
+
+def skipSession( tag, father, cls):
+	"""Check if the session of the node can be skipped, when only some sessions are selected (Config.selection)
+	ie neither the session nor its nested sessions are selected
+	The node is only scanned: the files it imports are parsed (to find the nested sessions), but not inserted, and no Tag/Session object is built.
+	The counters of the session types are updated with the sessions of the node, so that the following sessions get the same number
+	as in a full build"""
+	counts = {}		# number of nested sessions (per type)
+	attrs, imported = importedNodes( tag)
+	attrs = dict( tag.attrs, **attrs)
+	contents = tag.contents + imported
+	stack = [ c for c in contents if isinstance(c, Node) ]
+	while stack:
+		t = stack.pop()
+		tAttrs, tImported = importedNodes( t)
+		nested = Config.allSessions.get( t.name)
+		if nested:
+			if 'make' in nested.__dict__ and mayBeSelected( t.name, tAttrs.get('name') or t.get('name')):
+				return False
+			counts[t.name] = counts.get(t.name, 0) + 1
+		stack.extend( c for c in t.contents + tImported if isinstance(c, Node) )
+	# name of the session (the children are numbered before their father)
+	if attrs.get('name'):
+		name = attrs['name']
+	elif 'name' in attrs or 'name' in father.dict or any( isinstance(c, Node) and c.name == 'name' and containsTextOnly(c) for c in contents ):
+		name = None		# the name comes from the dictionary (a StrLang, that is not selected by the command line)
+	else:
+		name = tag.name + str( cls.number + counts.get(tag.name, 0) + 1 )
+	if tag.name in Config.selection or name in Config.selection:
+		return False
+	for typ, n in counts.items():
+		Config.allSessions[typ].number += n
+	cls.number += 1
+	return True
+
+
+
+_renderer = None		# jinja renderer (created when it is first used, see getRenderer)
+_bytecodePath = None		# folder where the bytecode of the templates is kept between the runs (see setBytecodeCache)
+_contents = {}		# sources of the Content templates: name (from their hash) -> (source, filename, uptodate)
+_templateFiles = {}		# template files loaded: template -> (set of the variables used, hash of the sources), see templateFile
+_fragments = Cache('fragments')		# strings produced by getStringFromTemplate(..., memoize=True) (key: template, lang, values of the variables used)
+
+
+def getRenderer():
+	"""Return the jinja renderer (jinja is only imported when a template is rendered)"""
+	global _renderer
+	if _renderer is None:
+		import jinja2
+		# jinja renderer (change the default delimiters used by Jinja such that it won't pick up brackets attached to LaTeX macros.)
+		# cfhttp://tex.stackexchange.com/questions/40720/latex-in-industry
+		_renderer = jinja2.Environment(
                         block_start_string = '{%%',
                         block_end_string = '%%}',
                         comment_start_string='{%<',
                         comment_end_string='>%}',
                         variable_start_string = '{{<',
                         variable_end_string = '>}}',
-                        loader = jinja2.FileSystemLoader( os.path.abspath('.') )
+                        loader = jinja2.ChoiceLoader( [ jinja2.FunctionLoader( lambda name: _contents.get(name) ), jinja2.FileSystemLoader( os.path.abspath('.') ) ] ),
+                        cache_size = 4096
                 )
+		setBytecodeCache( _bytecodePath)
+	return _renderer
+
+
+def __getattr__(name):
+	# the renderer is still available as Session.renderer
+	if name == 'renderer':
+		return getRenderer()
+	raise AttributeError( "module '"+__name__+"' has no attribute '"+name+"'" )
+
+
+def setBytecodeCache( path):
+	"""Store the bytecode of the compiled templates in the folder path (or only in memory if path is None)"""
+	global _bytecodePath
+	_bytecodePath = path
+	if _renderer is not None:
+		import jinja2
+		if path:
+			os.makedirs( path, exist_ok=True)
+			_renderer.bytecode_cache = jinja2.FileSystemBytecodeCache( path)
+		else:
+			_renderer.bytecode_cache = None
+
+
+@lru_cache( maxsize=4096)
+def templateVariables( source):
+	"""Return the set of the (undeclared) variables used by a template source
+	cf http://stackoverflow.com/questions/8260490/how-to-get-list-of-all-variables-in-jinja-2-templates"""
+	from jinja2 import meta
+	return frozenset( meta.find_undeclared_variables( getRenderer().parse(source) ) )
+
+
+@lru_cache( maxsize=4096)
+def templateReferences( source):
+	"""Return the names of the templates included, imported or extended by a template source (None for a name computed when rendering)"""
+	from jinja2 import meta
+	return tuple( meta.find_referenced_templates( getRenderer().parse(source) ) )
+
+
+def templateDependencies( source):
+	"""Return the set of the (undeclared) variables used by a template source and by the templates it references (recursively),
+	and the hash of its source and of theirs (None if the name of a referenced template is only known when rendering)"""
+	variables = set( templateVariables(source) )
+	h = md5( source.encode('utf-8') )
+	for name in templateReferences( source):
+		if name is None:
+			h = None
+		else:
+			v, referenced = templateFile( getRenderer().get_template( name) )
+			variables |= v
+			if h is not None and referenced is not None:
+				h.update( referenced.encode('utf-8') )
+			else:
+				h = None
+	return frozenset( variables), h and h.hexdigest()
+
+
+def templateFile( template):
+	"""Return the set of the (undeclared) variables used by a template file and by the templates it references, and the hash of their sources
+	(only computed once for each file loaded)"""
+	if template not in _templateFiles:
+		source = getRenderer().loader.get_source( getRenderer(), template.name)[0]
+		_templateFiles[template] = templateDependencies( source)
+	return _templateFiles[template]
+
+
+def forgetTemplates():
+	"""Forget the variables and hashes of the template files (the templates they reference may have changed since, in watch mode)"""
+	_templateFiles.clear()
+
+
+def contentTemplate( source):
+	"""Return the template of a Content
+	The templates are named from the hash of their source, so they are compiled only once (and their bytecode is cached)"""
+	name = '<Content ' + md5( source.encode('utf-8') ).hexdigest() + '>'
+	if name not in _contents:
+		_contents[name] = (source, None, lambda: True)
+	return getRenderer().get_template( name)
+
+
+def render( template, context):
+	"""Render the template with the context
+	(same as template.render(context), except that the context is not copied, so that a LazyContext remains lazy)"""
+	ctx = template.new_context( context, shared=True)
+	try:
+		return getRenderer().concat( template.root_render_func(ctx) )
+	except Exception:
+		return getRenderer().handle_exception()
+
+
+
+class LazyContext(Mapping):
+	"""Context of a template, built from a list of dictionaries (the first ones have the priority)
+	The StrLang values are converted to the lang only when they are read by the template,
+	and the converted values are kept for the rest of the render"""
+
+	def __init__(self, maps, lang):
+		self.maps = maps
+		self.lang = lang
+		self.values = {}		# values already read (and converted)
+
+	def __getitem__(self, key):
+		if key not in self.values:
+			for m in self.maps:
+				if key in m:
+					v = m[key]
+					self.values[key] = v.convertTo(self.lang) if isinstance(v,StrLang) else v
+					break
+			else:
+				raise KeyError(key)
+		return self.values[key]
+
+	def __setitem__(self, key, value):
+		self.values[key] = value
+
+	def __contains__(self, key):
+		return key in self.values or any( key in m for m in self.maps)
+
+	def __iter__(self):
+		return iter( set(self.values).union( *self.maps) )
+
+	def __len__(self):
+		return len( set(self.values).union( *self.maps) )
+
+	def raw(self, key):
+		"""Return a string that identifies the value associated to the key, before its conversion (None if there is no such key)"""
+		for m in self.maps:
+			if key in m:
+				v = m[key]
+				return (v.digest(), v.lang) if isinstance(v, StrLang) else str(v)
+		return None
+
+	def strLangs(self, keys):
+		"""Return the StrLang values (not yet read) associated to the keys"""
+		l = []
+		for key in keys:
+			if key not in self.values:
+				v = next( (m[key] for m in self.maps if key in m), None)
+				if isinstance(v, StrLang):
+					l.append(v)
+		return l
+
+
+
+class Variant(object):
+	"""Variant of the documents of a session (a LaTeX file compiled independently of the other variants)"""
+
+	def __init__(self, name, texFile, maxPasses=3, command='pdflatex', then=None):
+		self.name = name				# name of the variant (displayed in front of its outputs)
+		self.texFile = texFile			# LaTeX file (in the build directory) to compile
+		self.maxPasses = maxPasses		# max number of LaTeX passes
+		self.command = command			# LaTeX command
+		self.then = then or []			# commands to run once the LaTeX file is compiled (list of commands)
+
 
 
 def containsTextOnly( tag):
-	return (not tag.attrs) and tag.string and not tag.find_all()
+	"""True if the node has no attribute and only contains a (non-empty) string"""
+	return (not tag.attrs) and len(tag.contents) == 1 and isinstance(tag.contents[0], str) and bool(tag.contents[0])
+
+
+
+def importedFile( tag, fn):
+	"""Return the name of the file imported by fn (an item of the 'import' attribute of the node)"""
+	# get the filename (from the importPaths dictionary)
+	toImport = fn.strip().split(":")
+	d = {"#"+str(i+1):n for i,n in enumerate(toImport[:-1])}
+#TODO: changer self.tag.attrs par self.dict				
+	d.update(tag.attrs)
+	try:
+		path = Config.importPaths.get( tag.name, '' ).format( **d )
+	except:
+		raise mkcException( "The import path '"+fn+"' is not valid (do not correspond to the scheme '"+Config.importPaths.get(tag.name,'')+"' !)" )
+	fileNameExt = path + toImport[-1]
+	fileNameExt = fileNameExt.split(".")
+	fileName = fileNameExt[0] if len(fileNameExt)==1 else ".".join(fileNameExt[:-1])	# everything except the extension of the file, if there is an extension
+	# check if the file exist
+	if len(fileNameExt)==1:
+		fileName = fileAlmostExists(fileName, 'xml') or fileAlmostExists(fileName)
+	else:
+		fileName = fileAlmostExists(fileName, fileNameExt[-1])
+	if not fileName:
+		if tag in Config.importPaths:
+			raise mkcException( "The file " + path + toImport[-1] + ".xml"+" cannot be imported, it does not exist (or several paths exist)!" )
+		else:
+			raise mkcException( "The file " + path + toImport[-1] + ".xml"+" cannot be imported, probably because there is no specified path for the importation of tag <"+tag.name+"> or the file "+path + toImport[-1] + ".xml doesn't exist")
+	importedFiles.add( fileName)
+	return fileName
+
+
+def importedNodes( tag):
+	"""Return the attributes and the nodes that importFiles would add to the node, without modifying it
+	(used to scan the sessions that are skipped, see skipSession)"""
+	attrs, nodes = {}, []
+	if tag.has_attr('import'):
+		toImport = splitToComma( tag["import"] )
+		for fn in toImport:
+			fileName = importedFile( tag, fn)
+			if fileName.split('.')[-1] == 'xml':
+				im = parseFile( fileName, encoding=tag.attrs.get('encoding','utf-8'))
+				if im.contents and im.contents[0].name == tag.name and len(toImport)==1:
+					attrs.update( im.contents[0].attrs )
+					nodes.extend( im.contents[0].contents )
+				else:
+					nodes.extend( im.contents )
+	return attrs, nodes
 
-def doesNotContainsTextOnly( tag):
-	return not containsTextOnly(tag) or tag.name in Config.allSessions
 
+def importFiles( tag):
+	"""import the external files in the node, according to its 'import' attribute
+	(the node is extended, and its 'import' attribute is replaced by the 'imported' one)"""
+	
+	if tag.has_attr('import'):
+		start = time.perf_counter()
+		imported = []
+		# iterate over each filename
+		for fn in splitToComma( tag["import"] ):
+			fileName = importedFile( tag, fn)
+			# open the file, insert it in place
+			if Config.options.verbosity>0:
+				print( Fore.MAGENTA+"  Import file "+ fileName)
+			if fileName.split('.')[-1] == 'xml':
+#TODO: changer self.tag.attrs par self.dict					
+				im = parseFile( fileName, encoding=tag.attrs.get('encoding','utf-8'))
+				if im.contents:
+					if im.contents[0].name == tag.name and len(splitToComma( tag["import"] ))==1 :
+						# the imported tag is merged with the tag
+						tag.attrs.update( im.contents[0].attrs )
+						tag.contents.extend( im.contents[0].contents )
+					else:
+						tag.contents.extend( im.contents )
+				else:
+					raise mkcException( 'The file '+fileName+' is not valid !')
+			else:
+				tag.contents.append( codecs.open(fileName, encoding=tag.attrs.get('encoding','utf-8')).read() )
+
+			imported.append(fileName)
+			
+		tag["imported"] = ', '.join( "'"+i+"'" for i in imported)
+		del tag["import"]
+		profiling.record( 'import', tag["imported"], start, time.perf_counter()-start)
 
 
 class Tag(object):
 	"""XML tag
-	- tag (beautifulsoup tag)
+	- tag (node of the XML tree)
 	- dict (dictionary of attributes and stringOnly sons)
 	   attr -> string (StrLang)
+	   it is layered (ChainMap): only the attributes of the tag are stored in its first layer, the others are the layers of the father
 	"""
+	__slots__ = ('tag', 'father', 'lang', 'dict', 'children')
 
 	def __init__(self, tag, father):
 		
-		self.tag = tag # store the beautifulSoup tag
+		self.tag = tag # store the node of the XML tree
 		self.father = father
 		
-		# import the files (extend the BeautifulSoup tag)
+		# import the files (extend the node)
 		self.importFiles()
 		
 		# determine the language (LaTeX, Markdown, etc.)
@@ -76,85 +382,48 @@ class Tag(object):
 			self.lang = tag.attrs["lang"]
 		
 		# build the dictionary 
-		self.dict = dict(father.dict) if father else {}	# from the father
+		self.dict = father.dict.new_child() if father else ChainMap()	# from the father (shared, not copied)
 		self.dict.update( { attr: StrLang(val, self.lang) for attr,val in tag.attrs.items() } )	# from attributes
 		d = {}	# and from string-only children tags (that are not a session)
-		for t in tag( containsTextOnly, recursive=False):
-			if t.name not in Config.allSessions:
-				d[t.name] = StrLang(t.string, t.attrs.get("lang",self.lang))
+		others = []		# the other children tags
+		for t in tag.contents:
+			if isinstance(t, Node):
+				if t.name not in Config.allSessions and containsTextOnly(t):
+					d[t.name] = StrLang(t.string, t.attrs.get("lang",self.lang))
+				else:
+					others.append(t)
 		self.dict.update(d)
 
 		# recursive built
-		self.children = [ createTagSession(t, self) for t in self.tag(doesNotContainsTextOnly,recursive=False) ]	
+		self.children = [ c for c in ( createTagSession(t, self) for t in others ) if c is not None ]	
 			
 
 		
+	def ownItems(self):
+		"""Return the items of the dictionary that are not inherited from the father (the ones of its own layers)"""
+		if self.father is None:
+			return list( self.dict.items() )
+		inherited = { id(m) for m in self.father.dict.maps }
+		return [ item for m in reversed(self.dict.maps) if id(m) not in inherited for item in m.items() ]
+
+
 	def importFiles(self):
 		"""import the external files, according to the 'import' attribute"""
-		
-		if self.tag.has_attr('import'):
-			imported = []
-			# iterate over each filename
-			for fn in splitToComma( self.tag["import"] ):
-				# get the filename (from the importPaths dictionary)
-				toImport = fn.strip().split(":")
-				d = {"#"+str(i+1):n for i,n in enumerate(toImport[:-1])}
-#TODO: changer self.tag.attrs par self.dict				
-				d.update(self.tag.attrs)
-				try:
-					path = Config.importPaths.get( self.tag.name, '' ).format( **d )
-				except:
-					raise mkcException( "The import path '"+fn+"' is not valid (do not correspond to the scheme '"+Config.importPaths.get(self.tag.name,'')+"' !)" )
-				fileNameExt = path + toImport[-1]
-				fileNameExt = fileNameExt.split(".")
-				fileName = fileNameExt[0] if len(fileNameExt)==1 else ".".join(fileNameExt[:-1])	# everything except the extension of the file, if there is an extension
-				# check if the file exist
-				if len(fileNameExt)==1:
-					fileName = fileAlmostExists(fileName, 'xml') or fileAlmostExists(fileName)
-				else:
-					fileName = fileAlmostExists(fileName, fileNameExt[-1])
-				if not fileName:
-					if self.tag in Config.importPaths:
-						raise mkcException( "The file " + path + toImport[-1] + ".xml"+" cannot be imported, it does not exist (or several paths exist)!" )
-					else:
-						raise mkcException( "The file " + path + toImport[-1] + ".xml"+" cannot be imported, probably because there is no specified path for the importation of tag <"+self.tag.name+"> or the file "+path + toImport[-1] + ".xml doesn't exist")
-				# open the file, insert it in place
-				if Config.options.verbosity>0:
-					print( Fore.MAGENTA+"  Import file "+ fileName)
-				if fileName.split('.')[-1] == 'xml':
-#TODO: changer self.tag.attrs par self.dict					
-					im = BeautifulSoup(codecs.open(fileName, encoding=self.tag.attrs.get('encoding','utf-8')),features="xml")
-					if im.contents:
-						if im.contents[0].name == self.tag.name and len(splitToComma( self.tag["import"] ))==1 :
-							self.tag.attrs.update( im.contents[0].attrs )
-							#self.tag.replace_with( im.contents[0] )		#-> doesn't work, for an unknown reason (it used to work before...)
-							self.tag.append(im.contents[0])
-							self.tag(self.tag.name)[0].unwrap()
-					
-						else:
-							for i in range(len(im.contents)):
-								self.tag.append(im.contents[0])
-					else:
-						raise mkcException( 'The file '+fileName+' is not valid !')
-				else:
-					self.tag.append( codecs.open(fileName, encoding=self.tag.attrs.get('encoding','utf-8')).read() )
-	
-				imported.append(fileName)
-				
-			self.tag["imported"] = ', '.join( "'"+i+"'" for i in imported)
-			del self.tag["import"]
-	
+		importFiles( self.tag)
+
 
 	
 
 class Session(Tag):
+	__slots__ = ('type', 'name', 'commonFiles', 'previous', 'inputs', 'reasons', 'rendered', 'variants')
 
 	number = 0		# number of objects created (per session type)
 	sessionsToBuild = []		# list of the sessions object to build
+	tools = ('pdflatex',)		# tools used by make (their version is a dependency of the session)
 	
 	def __init__(self, tag, father):
 		"""
-		- tag (beautifulSoup object) to build the session
+		- tag (node of the XML tree) to build the session
 		- dictionary of commonFiles
 		"""
 		
@@ -172,13 +441,19 @@ class Session(Tag):
 			raise mkcException( "There is no commonFiles for the session "+self.type+ "!" )
 
 
+		# the keys of the session are put in a new layer (they are not seen by the children, already built)
+		self.dict = self.dict.new_child()
 		self.dict [ 'type' ] = self.type
 		self.name =  tag.get('name') or self.dict.get('name') or self.type+str(type(self).number)		# name of the Session (usually type+number)
 		self.dict[ 'name' ] = self.name
-		self.remainsUnchanged = False
+		self.previous = None		# record of the previous build (dependencies, rendered files)
+		self.inputs = {}			# dependencies (see dependencies())
+		self.reasons = []			# reasons why the session should be built
+		self.rendered = {}			# hashes of the files rendered by the last make
+		self.variants = []			# variants declared by make, and not compiled yet
 
 		#contents
-		self.dict[ 'Content' ] = StrLang( '\n'.join( l for l in self.tag.contents if isinstance(l,NavigableString) and not isinstance(l,Comment) ), lang=self.lang )
+		self.dict[ 'Content' ] = StrLang( '\n'.join( l for l in self.tag.contents if isinstance(l,str) and not isinstance(l,Comment) ), lang=self.lang )
 
 		# check if the Session has to be built or not
 		if 'make' in type(self).__dict__:
@@ -187,85 +462,162 @@ class Session(Tag):
 	def files(self, options):
 		"""returns the files that are produced when making the session (none if not specified)"""
 		return []
+
+
+	def posts(self, options):
+		"""returns the posts of the session to publish to Wordpress, as a list of (title, content, category)
+		(they are published with -w when the session is built, or with --publish without building it)"""
+		return []
 	
 		
 
 
+	def resourceDirectories(self):
+		"""Return the list of the directories of the imported files (their content is copied in the build directory)"""
+		dirs = []
+		for p in splitToComma( self.tag.get("imported",'') ):
+			pPath = '/'.join(p.strip().split('/')[0:-1])
+			if pPath and pPath not in dirs:
+				dirs.append(pPath)
+		return dirs
+
+
+	def dependencies(self):
+		"""Return the dependencies of the session, as a dictionary node -> content hash
+		The nodes are the attributes of the session and of its children (recursively), the imported files, the resources
+		copied in the build directory, the commonFiles and the tools used"""
+		deps = {}
+		commonFiles = set()
+		stack = [ (self, self.name) ]
+		while stack:
+			t, path = stack.pop()
+			# attributes (only the ones that are not inherited, for the children)
+			for key,val in ( t.dict.items() if t is self else t.ownItems() ):
+				deps[ "attribute "+path+"/"+key ] = val.digest() if isinstance(val, StrLang) else md5( str(val).encode('utf-8') ).hexdigest()
+			for f in splitToComma( t.tag.get("imported","") ):
+				deps[ "imported file "+f ] = fileHash(f)
+			if isinstance(t, Session) and t.commonFiles:
+				commonFiles.add(t.commonFiles)
+			stack.extend( (c, path+"/"+c.tag.name+str(i)) for i,c in enumerate(t.children) )
+		# resources and commonFiles (copied in the build directory)
+		for d in self.resourceDirectories():
+			for root, subFolders, files in os.walk(d):
+				for f in files:
+					deps[ "resource "+os.path.join(root,f) ] = fileHash( os.path.join(root,f) )
+		for c in commonFiles:
+			for f in glob(c+'*'):
+				if os.path.isfile(f):
+					deps[ "commonFile "+f ] = fileHash(f)
+		# tools
+		deps[ "tool pandoc" ] = pandocIdentity()
+		for tool in self.tools:
+			deps[ "tool "+tool ] = toolIdentity(tool)
+		return deps
+
+
 	def shouldBeMake(self, scheme, options):
 		"""determine if the unit should be make
 		(the documents of the units should be produced)
-		(if the previously produced files are older than the files necessary to build the unit, then we should make the unit
+		It is the case when one of its dependencies has changed since its last build, or when a produced file is missing
+		(the reasons are stored in self.reasons)
 		"""
-		if self.remainsUnchanged:
-			# get the time of the oldest produced file (if the file exist)
-			oldestTimeProducedFile = time.time()
-			for f in self.files(options):
-				target = scheme.format( **self.dict ) + f
-				targetTime = os.path.getmtime(target) if os.path.exists(target) else 0
-				if oldestTimeProducedFile>targetTime:
-					oldestTimeProducedFile = targetTime
-			# get the time of all the possible files
-			importedFiles = splitToComma( self.tag.get("imported","") )
-			pathTimes = [ getPathTime(os.path.dirname(p.strip())) for p in importedFiles ]
-			if pathTimes and self.tag["imported"]:
-				newestTimeParts = max( pathTimes )
-			else:
-				newestTimeParts = 0
-
-			return newestTimeParts > oldestTimeProducedFile
+		self.inputs = self.dependencies()
+		self.reasons = []
+		if self.previous is None:
+			self.reasons.append( "never built" )
 		else:
-			return True
+			previousInputs = self.previous['inputs']
+			for node in sorted( set(self.inputs) | set(previousInputs) ):
+				if node not in previousInputs:
+					self.reasons.append( "new "+node )
+				elif node not in self.inputs:
+					self.reasons.append( "no more "+node )
+				elif self.inputs[node] != previousInputs[node]:
+					self.reasons.append( node+" changed" )
+		for f in self.files(options):
+			target = scheme.format( **self.dict ) + f
+			if not os.path.exists(target):
+				self.reasons.append( "missing "+target )
+		return bool(self.reasons)
+
+
+	def resourceFiles(self):
+		"""Return the list of the resources of the session, as (source path, path relative to the build directory)
+		ie the commonFiles and the content of the directories of the imported files"""
+		files = [ (f, os.path.basename(f)) for f in glob(self.commonFiles+'*') if os.path.isfile(f) ]
+		for pPath in self.resourceDirectories():
+			# same layout as 'cp -R pPath/ dest' (the BSD cp copies the content of the directory, the GNU cp the directory itself)
+			prefix = '' if platform.system()=='Darwin' else os.path.basename(pPath)
+			for root, subFolders, fileNames in os.walk(pPath):
+				files.extend( (os.path.join(root,f), os.path.join( prefix, os.path.relpath(root,pPath), f)) for f in fileNames )
+		return [ (src, os.path.normpath(rel)) for src,rel in files ]
 
 
 	def prepareResources(self, dest):
-		"""Prepare (copy) the resources (commonFiles) of a session into the dest folder (temporary or debug) """
-		runCommand( ['cp', self.commonFiles+'*', dest])
-		done = {}
-		for p in splitToComma( self.tag.get("imported",'') ):
-			pPath = '/'.join(p.strip().split('/')[0:-1])
-			if pPath not in done:
-				runCommand( ['cp', '-R', pPath+"/", dest])
-				done[ pPath ]=True
+		"""Prepare the resources (commonFiles and imported directories) of a session into the dest folder (temporary, debug or staging)
+		According to the --staging option, they are hard-linked (default), symbolic-linked or copied"""
+		with span( 'stage', self.name):
+			stageFiles( self.resourceFiles(), dest, Config.options.staging)
 
 
-	def getStringFromTemplate(self, templateFileName, dictionary=None, lang=None, encoding='utf-8' ):
+	def getStringFromTemplate(self, templateFileName, dictionary=None, lang=None, encoding='utf-8', memoize=False ):
 		"""Read the template file and fill it with the dictionnary (and the content of the session, that is also templated, of course)
 		and returns the result
+		With memoize, the result is kept in the cache, and reused for the same template, lang and values of the variables used
+		(for example for an exercise included in several sessions)
 		"""
 		
-		# dictionary for the template file
+		# dictionary for the template file (its StrLang values are translated only when the template reads them)
 		if dictionary is None:
 			dictionary = { }
-		d = dict( self.dict, **dictionary )		# http://stackoverflow.com/questions/1781571/how-to-concatenate-two-dictionaries-to-create-a-new-one-in-python
-		d["Filename"] = self.commonFiles+templateFileName
-		if 'Date' not in d:
+		extra = { "Filename": self.commonFiles+templateFileName }
+		if 'Date' not in dictionary and 'Date' not in self.dict:
 			now = datetime.datetime.now()
-			d['Date'] = now.strftime('%d/%m/%Y - %H:%M')
-		
-		# translate the dictionary
-		for k,v in d.items():
-			if isinstance(v,StrLang):
-				d[k] = v.convertTo(lang)
+			extra['Date'] = now.strftime('%d/%m/%Y - %H:%M')
+		d = LazyContext( [extra, dictionary, self.dict, getRenderer().globals], lang)
+
+		# get the variables used by the template, and convert them all at once (one pandoc call instead of one per variable)
+		fileTemplate = getRenderer().get_template( self.commonFiles+templateFileName, encoding)
+		variables, templateHash = templateFile( fileTemplate)
+		convertAll( d.strLangs( variables | {'Content'} ), lang)
+
+		# look for the same render (same templates, included ones too, and values of the variables used by the templates or by the Content)
+		# (not when the name of a template referenced is computed when rendering)
+		if memoize:
+			contentVariables, contentHash = templateDependencies( str(d["Content"]) ) if Config.rendererContent else (frozenset(), '')
+			memoize = templateHash is not None and contentHash is not None
+		if memoize:
+			used = variables | {'Content'} | contentVariables
+			key = hashKey( templateHash, contentHash, lang, Config.rendererContent, pandocVersion(), sorted( (var, d.raw(var)) for var in used ) )
+			t = _fragments.get(key)
+			if t is not None:
+				return t
+
+		with span( 'render', templateFileName):
+			t = self._render( fileTemplate, templateFileName, variables, d, lang)
+		if memoize:
+			_fragments.set( key, t)
+		return t
+
+
+	def _render(self, fileTemplate, templateFileName, variables, d, lang):
+		"""Render the template file with the context d (and the Content, that is also templated)"""
 
 		# template the Content
 		if Config.rendererContent:
-			template = renderer.from_string(d["Content"])
-			d["Content"] = template.render(d)
+			template = contentTemplate( d["Content"])
+			convertAll( d.strLangs( templateVariables(d["Content"]) ), lang)
+			d["Content"] = render(template, d)
 
 		
-		#open the template file and render it
-		template = renderer.get_template( self.commonFiles+templateFileName, encoding)
-		t=template.render( d )
+		# render the template file
+		t=render( fileTemplate, d )
 
 		# get the list of unused variables
-		# cf http://stackoverflow.com/questions/8260490/how-to-get-list-of-all-variables-in-jinja-2-templates
-		parsed_content = renderer.parse(template)
-		variables = meta.find_undeclared_variables(parsed_content)
 		unusedVariables = [ var for var in variables if var not in d ]
 		if unusedVariables and Config.options.verbosity>0:
 			print( Fore.GREEN + "In the template '" + templateFileName + "' the following variables are unused :" + ",".join(unusedVariables) + Fore.RESET + Style.NORMAL)
 
-		
 		return t
 	
 
@@ -277,17 +629,121 @@ class Session(Tag):
 		if dictionary is None:
 			dictionary = { }
 		t = self.getStringFromTemplate(templateFileName, dictionary, lang, encoding)
-		#create the new file
-		resultFile = io.open( fileName, "w", encoding=encoding)
+		self.rendered[fileName] = md5( t.encode(encoding) ).hexdigest()
+		#create the new file (write it aside and then replace, so that a staged resource linked at that place is not modified)
+		resultFile = io.open( workPath(fileName)+".mkc-tmp", "w", encoding=encoding)
 		resultFile.write( t )
 		resultFile.close()
+		os.replace( workPath(fileName)+".mkc-tmp", workPath(fileName))
+
+
+	def compileLaTeX(self, texFile, maxPasses=3, command='pdflatex', others=(), prefix=''):
+		"""Compile a LaTeX file (of the build directory), as many times as needed (but at most maxPasses times)
+		If the same source (with the same other rendered files, resources and tools) has already been compiled,
+		the pdf produced then is restored from the cache instead (except with -f)
+		(others are the rendered files that are not used by texFile, ie the LaTeX files of the other variants)"""
+		pdfFile = os.path.splitext(texFile)[0]+'.pdf'
+		if not self.inputs:
+			self.inputs = self.dependencies()
+		# (the attributes and the imported files only reach LaTeX through the rendered files, so they are not in the key)
+		imported = { os.path.normpath( node[len("imported file "):] ) for node in self.inputs if node.startswith("imported file ") }
+		inputs = sorted( (node, h) for node, h in self.inputs.items() if not node.startswith( ("attribute ", "imported file ") )
+			and not ( node.startswith("resource ") and os.path.normpath( node[len("resource "):] ) in imported ) )
+		key = hashKey( command, maxPasses, fileHash( workPath(texFile) ), sorted( (f,h) for f,h in self.rendered.items() if f not in others ), inputs)
+		# (with -f, LaTeX is always run: the updates of the LaTeX packages are not seen by the key)
+		if not Config.options.force and _latexOutputs.getFile( key, workPath(pdfFile) ):
+			if Config.options.verbosity>0:
+				display( Fore.MAGENTA + prefix + '> ' + pdfFile + ' restored from the cache (' + texFile + ' has not changed)' + Fore.RESET)
+		else:
+			fmt = self.preambleFormat(texFile, command, prefix) if Config.options.preamble else None
+			runLaTeX( texFile, maxPasses, command, fmt, prefix)
+			_latexOutputs.setFile( key, workPath(pdfFile) )
+
+
+	def addVariant(self, name, texFile, maxPasses=3, command='pdflatex', then=None):
+		"""Declare a variant of the documents: texFile (already written in the build directory) will be compiled,
+		and then the commands of the list then will be run
+		The variants are independent, they are compiled at the same time (and cached separately) by buildVariants,
+		that is called after make (or by make itself, when it needs their documents)"""
+		self.variants.append( Variant( name, texFile, maxPasses, command, then) )
+
+
+	def buildVariants(self):
+		"""Compile the variants declared (each one in its own thread, the work is done by the LaTeX processes)
+		An exception is raised, once they are all finished, if one of them failed"""
+		variants, self.variants = self.variants, []
+		if not variants:
+			return
+		if not self.inputs:
+			self.inputs = self.dependencies()
+		texFiles = [ v.texFile for v in variants ]
+		width = max( len(v.name) for v in variants )
+
+		def build(v):
+			prefix = v.name.ljust(width)+' | ' if len(variants)>1 else ''
+			with span( 'variant', self.name+' '+v.name):
+				self.compileLaTeX( v.texFile, v.maxPasses, v.command, [ f for f in texFiles if f != v.texFile ], prefix)
+				for cmd in v.then:
+					runCommand( cmd, prefix=prefix)
+
+		# (the variants running at the same time cannot share the terminal: they do not read stdin, and do not wait at a LaTeX prompt)
+		interactive = osUtils.interactive
+		osUtils.interactive = interactive and len(variants) == 1
+		try:
+			from concurrent.futures import ThreadPoolExecutor
+			with ThreadPoolExecutor( len(variants) ) as pool:
+				futures = [ pool.submit( build, v) for v in variants ]
+		finally:
+			osUtils.interactive = interactive
+		errors = [ f.exception() for f in futures if f.exception() ]
+		if errors:
+			raise errors[0]
+
+
+	def preambleFormat(self, texFile, command='pdflatex', prefix=''):
+		"""Return the name of a format (in the build directory) where the preamble of texFile is precompiled (with mylatexformat)
+		or None if it cannot be built
+		The preamble goes until \\endofdump (or \\begin{document}), so the parts specific to a session should be put after \\endofdump.
+		The formats are kept in the cache, and shared by all the documents with the same preamble and the same .sty/.cls files"""
+		with io.open( workPath(texFile), encoding='utf-8', errors='replace') as f:
+			source = f.read()
+		end = source.find('\\endofdump')
+		if end < 0:
+			end = source.find('\\begin{document}')
+		if end < 0:
+			return None
+		styles = sorted( (f, fileHash(workPath(f))) for f in os.listdir( workPath('.') ) if f.endswith( ('.sty','.cls') ) )
+		key = hashKey( command, toolIdentity(command), source[:end], styles)
+		fmt = 'mkc-'+key[:16]
+		with _formatsLock:
+			if key in _failedFormats:
+				return None
+			# (the format may already be in the build directory, built for another variant: its name comes from its key)
+			if not os.path.exists( workPath(fmt+'.fmt') ) and not _formats.getFile( key, workPath(fmt+'.fmt') ):
+				try:
+					runCommand( [command, '-ini', '-interaction=nonstopmode', '-jobname='+fmt, "'&"+command+"'", 'mylatexformat.ltx', texFile], prefix=prefix )
+				except mkcException:
+					pass		# (the document is compiled without precompiled preamble)
+				if not os.path.exists( workPath(fmt+'.fmt') ):
+					display( Fore.YELLOW + prefix + 'The preamble of '+texFile+' cannot be precompiled (is mylatexformat installed?)' + Fore.RESET)
+					_failedFormats.add(key)
+					return None
+				_formats.setFile( key, workPath(fmt+'.fmt') )
+		return fmt
+
+
+	def prefetchConversions(self, lang):
+		"""Convert at once (one pandoc call per lang) all the StrLang of the session and of its children,
+		so that the following renders of the session and of its children do not call pandoc"""
+		strLangs = [ v for v in self.dict.values() if isinstance(v, StrLang) ]
+		stack = list( self.children )
+		while stack:
+			t = stack.pop()
+			strLangs.extend( v for k,v in t.ownItems() if isinstance(v, StrLang) )
+			stack.extend( t.children )
+		convertAll( strLangs, lang)
 
 
-	def checkDifferences(self, data):
-		"""compare the current session with the previous one (to check if something has changed and if we need to build it or not)"""
-		self.remainsUnchanged = not set( (key,md5(str(val).encode('utf-8')).hexdigest()) for key,val in self.dict.items() ) - set(data.items())
-		
-		
 	def iterall(self, tagName):
 		"""return a generator on the children with a tag 'tagName'"""
 		return (t for t in self.children if t.tag.name==tagName)
@@ -1,25 +1,172 @@
-import pypandoc
+import os
+import re
+import shutil
+import importlib.util
+from hashlib import md5
 from .mkcException import mkcException
+from .cache import Cache, hashKey
+from .osUtils import toolIdentity
+from . import profiling
+import time
+
+# (pypandoc is only imported when pandoc is really needed, and the formats and the version of pandoc are kept in the cache)
+
+_conversions = Cache('pandoc')		# cache of the conversions (string, from lang, to lang, pandoc version) -> converted string
+_pandocInfos = Cache('pandoc-infos')		# formats and version of pandoc (key: identity of pandoc)
+_pandoc = {}		# formats and version of pandoc, for this run
+
+
+def pandocPath():
+	"""Return the path of pandoc, found without running it (and without importing pypandoc, if possible):
+	the one given by PYPANDOC_PANDOC, or the one in the PATH, or the one bundled with pypandoc"""
+	if 'path' not in _pandoc:
+		path = os.environ.get('PYPANDOC_PANDOC') or shutil.which('pandoc')
+		if not path:
+			spec = importlib.util.find_spec('pypandoc')
+			for d in (spec and spec.submodule_search_locations) or []:
+				for name in ('pandoc', 'pandoc.exe'):
+					if os.path.isfile( os.path.join(d, 'files', name) ):
+						path = os.path.join(d, 'files', name)
+		if not path:
+			import pypandoc
+			path = pypandoc.get_pandoc_path()
+		_pandoc['path'] = path
+	return _pandoc['path']
+
+
+def pandocIdentity():
+	"""Return a string that identifies the installed pandoc (without running it)"""
+	return toolIdentity( pandocPath() )
+
+
+def pandocInfos():
+	"""Return the formats (input formats, output formats) and the version of pandoc
+	They are only asked to pandoc once for each installed pandoc (they are kept in the cache)"""
+	if 'infos' not in _pandoc:
+		key = hashKey( 'infos', pandocIdentity() )
+		infos = _pandocInfos.get(key)
+		if infos is None:
+			import pypandoc
+			infos = pypandoc.get_pandoc_formats() + (pypandoc.get_pandoc_version(),)
+			_pandocInfos.set(key, infos)
+		_pandoc['infos'] = infos
+	return _pandoc['infos']
+
+
+def pandocVersion():
+	"""Return the version of pandoc"""
+	return pandocInfos()[2]
+
+
+def __getattr__(name):
+	# the lists of formats (from_formats and to_formats) are only computed when they are used
+	if name == 'from_formats':
+		return pandocInfos()[0]
+	if name == 'to_formats':
+		return pandocInfos()[1]
+	raise AttributeError( "module '"+__name__+"' has no attribute '"+name+"'" )
+
+
+# fragments that may interact with the other fragments of a batch (notes, link references, headers and their identifiers, macros)
+# are not batched, they are converted alone
+_isolated = re.compile( r"""\[\^|\^\[|^ {0,3}\[[^\]]+\]:|^ {0,3}#|^ {0,3}[-=~^"'`*+]{3,}\s*$|^\.\. |<h[1-6]|\\(re)?newcommand|\\def\b|\\footnote|\\label|\\(sub)*section|\\chapter""", re.M)
+# blocks that may stay open until the next fragments (raw HTML, code fences, LaTeX environments) are not batched either
+# (except the HTML of the HTML fragments, that is closed by the parser)
+_openBlocks = re.compile( r"""</?[a-zA-Z]|^ {0,3}(```|~~~)|\\begin\{""", re.M)
+
+
+def _batchable( s):
+	"""True if the StrLang s can be converted together with other fragments"""
+	if _separator(s.lang) is None or _isolated.search(s.string):
+		return False
+	return s.lang.startswith('html') or not _openBlocks.search(s.string)
+
+
+def _separator(lang):
+	"""Return the separator (paragraph with a {0} token) used to join the fragments written in lang
+	(or None if the fragments written in that lang cannot be batched)"""
+	if lang.startswith('html'):
+		return '\n<p>{0}</p>\n'
+	if lang.startswith('markdown') or lang in ('gfm', 'commonmark', 'latex', 'rst'):
+		return '\n\n{0}\n\n'
+	return None
+
+
+def convertAll( strLangs, lang):
+	"""Convert several StrLang to lang, with only one pandoc call per source lang:
+	the fragments are joined with a unique separator, converted together and split back
+	(the results are put in the cache, so that the following convertTo are immediate,
+	the fragments that cannot be batched are left to convertTo)"""
+	if lang is None or lang not in pandocInfos()[1]:
+		return
+	pending = {}		# source lang -> {key: string}
+	for s in strLangs:
+		if s.lang is not None and s.lang != lang and _batchable(s):
+			key = s.key(lang)
+			if _conversions.get(key) is None:
+				pending.setdefault( s.lang, {} )[key] = s.string
+	for src, fragments in pending.items():
+		if len(fragments)>1:
+			import pypandoc
+			from uuid import uuid4
+			token = 'MKCSEP' + uuid4().hex.upper()
+			keys = list(fragments)
+			start = time.perf_counter()
+			try:
+				converted = pypandoc.convert( _separator(src).format(token).join( fragments[k] for k in keys ), format=src, to=lang)
+			except (RuntimeError, OSError):
+				# (a malformed fragment makes the whole batch fail: the fragments are left to convertTo, that only converts those that are used)
+				continue
+			profiling.record( 'pandoc', src+' -> '+lang+' ('+str(len(keys))+' fragments)', start, time.perf_counter()-start)
+			profiling.count( 'pandoc call', time.perf_counter()-start)
+			pieces = re.split( r'\n*[^\n]*'+token+r'[^\n]*\n*', converted)
+			# pandoc ends each conversion with one newline
+			if len(pieces) == len(keys):
+				for k,p in zip(keys,pieces):
+					_conversions.set( k, p.strip('\n')+'\n' )
+
 
-(from_formats,to_formats) = pypandoc.get_pandoc_formats()
 
 class StrLang(object):
 	"""Class defining a string, PLUS mention of its lang (ie LaTeX, Markdown, etc.)"""
+	__slots__ = ('string', 'lang', '_digest')
+
 	def __init__(self, string, lang=None):
-		if lang is not None  and  lang not in from_formats:
+		if lang is not None  and  lang not in pandocInfos()[0]:
 			raise mkcException( "The lang "+ lang+" cannot be converted by Pandoc.")
 		self.string=string
 		self.lang=lang
+		self._digest = None
 		
 	def convertTo(self, lang=None):
-		if lang is not None  and lang not in to_formats:
+		if lang is not None  and lang not in pandocInfos()[1]:
 			raise mkcException( "The string '"+self.string+"' cannot be converted to "+lang+" by Pandoc ('"+lang+"' is not supported).")
 		
 		if lang is not None and self.lang != lang and self.lang is not None:
-			return pypandoc.convert( self.string, format=self.lang, to=lang)
+			# look in the cache first (the conversions are the same from one run to another)
+			key = self.key(lang)
+			converted = _conversions.get(key)
+			if converted is None:
+				import pypandoc
+				start = time.perf_counter()
+				converted = pypandoc.convert( self.string, format=self.lang, to=lang)
+				profiling.record( 'pandoc', self.lang+' -> '+lang, start, time.perf_counter()-start)
+				profiling.count( 'pandoc call', time.perf_counter()-start)
+				_conversions.set(key, converted)
+			return converted
 		else:
 			return self.string
 		
+	def key(self, lang):
+		"""key of the conversion of the string to lang (in the conversions cache)"""
+		return hashKey( self.string, self.lang, lang, pandocVersion() )
+		
+	def digest(self):
+		"""md5 hash of the string (computed only once)"""
+		if self._digest is None:
+			self._digest = md5( self.string.encode('utf-8') ).hexdigest()
+		return self._digest
+
 	def __str__(self):
 		return self.string
 	
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+	Content-addressed cache, shared between the runs
+
+	The values are kept in memory (LRU) and stored on disk, one file per key
+	(in Config.cachePath/<name>/), so that they are also shared by the worker processes.
+	Nothing is stored on disk when Config.cachePath is None (option --no-cache)
+	The on-disk stores are bounded: the least recently used files are removed by pruneCache (option --cache-size)
+"""
+
+import os
+import pickle
+import shutil
+from hashlib import md5
+from collections import OrderedDict
+from tempfile import mkstemp
+from .config import Config
+from . import profiling
+
+
+def hashKey( *parts):
+	"""return the key (hexadecimal md5 hash) of a list of parts (converted to strings)"""
+	h = md5()
+	for p in parts:
+		h.update( str(p).encode('utf-8') )
+		h.update( b'\0' )
+	return h.hexdigest()
+
+
+class Cache(object):
+	"""Content-addressed cache (in-memory LRU + on-disk store)"""
+
+	def __init__(self, name, maxsize=4096):
+		self.name = name				# name of the cache (and of its folder)
+		self.maxsize = maxsize			# number of values kept in memory
+		self._memory = OrderedDict()
+
+
+	def path(self, key):
+		"""Return the path where the value of key is stored on disk (or None if the cache is in-memory only)"""
+		if not Config.cachePath:
+			return None
+		return os.path.join( Config.cachePath, self.name, key[:2], key)
+
+
+	def get(self, key, default=None):
+		"""Return the value associated to key (or default if the key is unknown)"""
+		if key in self._memory:
+			self._memory.move_to_end(key)
+			profiling.count( 'cache '+self.name+' hit')
+			return self._memory[key]
+		path = self.path(key)
+		if path:
+			try:
+				with open(path, 'rb') as f:
+					value = pickle.load(f)
+			except (IOError, EOFError, pickle.UnpicklingError):
+				profiling.count( 'cache '+self.name+' miss')
+				return default
+			_touch(path)
+			self._remember(key, value)
+			profiling.count( 'cache '+self.name+' hit')
+			return value
+		profiling.count( 'cache '+self.name+' miss')
+		return default
+
+
+	def set(self, key, value):
+		"""Associate value to key (in memory and on disk)"""
+		self._remember(key, value)
+		path = self.path(key)
+		if path:
+			os.makedirs( os.path.dirname(path), exist_ok=True)
+			# write in a temporary file first, so that a concurrent reader never gets a partial value
+			fd, tmp = mkstemp( dir=os.path.dirname(path) )
+			with os.fdopen(fd, 'wb') as f:
+				pickle.dump(value, f)
+			os.replace(tmp, path)
+
+
+	def getFile(self, key, dest):
+		"""Copy the file stored with key to dest (return False if there is no such file)
+		dest is replaced, not overwritten (it may be a link to another file)"""
+		path = self.path(key)
+		if not path or not os.path.exists(path):
+			profiling.count( 'cache '+self.name+' miss')
+			return False
+		profiling.count( 'cache '+self.name+' hit')
+		_touch(path)
+		shutil.copyfile(path, dest+'.mkc-tmp')
+		os.replace(dest+'.mkc-tmp', dest)
+		return True
+
+
+	def setFile(self, key, src):
+		"""Store (a copy of) the file src with key (on disk only)"""
+		path = self.path(key)
+		if path and os.path.exists(src):
+			os.makedirs( os.path.dirname(path), exist_ok=True)
+			fd, tmp = mkstemp( dir=os.path.dirname(path) )
+			os.close(fd)
+			shutil.copyfile(src, tmp)
+			os.replace(tmp, path)
+
+
+	def _remember(self, key, value):
+		"""put the value in the in-memory LRU"""
+		self._memory[key] = value
+		self._memory.move_to_end(key)
+		if len(self._memory) > self.maxsize:
+			self._memory.popitem(last=False)
+
+
+def _touch( path):
+	"""mark the file as recently used (the least recently used files are the first removed by pruneCache)"""
+	try:
+		os.utime(path)
+	except OSError:
+		pass
+
+
+def pruneCache( maxSize):
+	"""Remove the least recently used files of the on-disk cache (the staging directories are left untouched)
+	until it takes at most maxSize bytes
+	Returns the number of files removed"""
+	if not Config.cachePath:
+		return 0
+	files = []
+	for root, dirs, names in os.walk( Config.cachePath):
+		if root == Config.cachePath:
+			dirs[:] = [ d for d in dirs if d != 'stage' ]
+		for n in names:
+			try:
+				st = os.stat( os.path.join(root, n) )
+			except OSError:
+				continue
+			files.append( (st.st_mtime_ns, st.st_size, os.path.join(root, n)) )
+	total = sum( size for _, size, _ in files )
+	removed = 0
+	for _, size, path in sorted(files):
+		if total <= maxSize:
+			break
+		try:
+			os.remove(path)
+		except OSError:
+			continue
+		total -= size
+		removed += 1
+	return removed
@@ -10,6 +10,11 @@ class Config:
 	commonFiles = {}					# commonFiles: schemes to know where to find the commonFiles (dictionary session name -> path)
 	allSessions = {}
 	rendererContent = False				# tells if we should renderer the Content or not 
+	cachePath = None					# path of the caches shared between the runs (None for no on-disk cache)
+	stagePath = None					# path where the build directories of the sessions are kept between the runs (None for temporary directories)
+	selection = None					# names and types of the sessions selected on the command line (None when all the sessions are built)
+	WP = None							# Wordpress client (wordpress.WP) used by the sessions to publish their posts (set by the course script)
+	WPcategory = None					# category of the posts
 	
 	@staticmethod
 	def add_option(*opt1,**opt2):
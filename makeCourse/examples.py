@@ -1,5 +1,5 @@
 from makeCourse.Session import Session
-from makeCourse.osUtils import runCommand
+from makeCourse.osUtils import runCommand, runCommands
 from makeCourse.config import Config
 from makeCourse.mkcException import mkcException
 
@@ -12,20 +12,19 @@ class CM(Session):
 			# build and compile (handout)
 			print( " - build handout")
 			self.writeFileFromTemplate( 'CM.tex', self.name+'-handout.tex', {'documentclass' :  '\documentclass[handout]{beamer}'}, lang='latex' )
-			runCommand( ['pdflatex', self.name+'-handout.tex'],2 )
-			# printable bersion
-			print( " - build printable version")
-			runCommand(  ['pdfnup', '-q', '--nup', '2x2', '--suffix', "'2x2'", self.name+'-handout.pdf'] )
+			# and its printable version
+			self.addVariant( 'handout', self.name+'-handout.tex', then=[ ['pdfnup', '-q', '--nup', '2x2', '--suffix', "'2x2'", self.name+'-handout.pdf'] ])
 		# build and compile (slides)
 		print( " - build slides")
 		self.writeFileFromTemplate( 'CM.tex', self.name+'.tex', {'documentclass' :  '\documentclass{beamer}'}, lang='latex' )
-		runCommand( ["pdflatex", self.name+".tex"], 1 if options.quick else 2  )
+		self.addVariant( 'slides', self.name+'.tex', 1 if options.quick else 3)
 		if not options.quick:
 
 			# build widescreen version
 			print( " - build widescreen slides")
 			self.writeFileFromTemplate( 'CM-screencast.tex', self.name+'-screencast.tex', lang='latex' )
-			runCommand( ["pdflatex", self.name+"-screencast.tex"], 2 )
+			self.addVariant( 'screencast', self.name+'-screencast.tex')
+		# (the variants are compiled at the same time, after make)
 		
 
 	def files(self, options):
@@ -43,19 +42,22 @@ class TP(Session):
 		# met à jour le fichier sty (avec année, etc.)
 		self.writeFileFromTemplate( 'tdtme.sty', 'tdtme.sty')
 		# construit le LaTeX des exercices
+		self.prefetchConversions('latex')
 		Content = '\n'.join( e.LaTeX() for e in self.iterall('Exercice') ) +  self.dict["Content"].convertTo(lang='latex')		# construit et compile
 		print( " - build student version")
 		self.writeFileFromTemplate( 'TP.tex', self.name+'-eleves.tex', {'Enseignants' :  '', 'Content':Content}, lang='latex')
-		runCommand( ["pdflatex", self.name+"-eleves.tex"], 2 )
+		self.addVariant( 'eleves', self.name+'-eleves.tex')
 		# construit et compile (version enseignant)
 		print( " - build teacher version")
 		self.writeFileFromTemplate( 'TP.tex', self.name+'-enseignants.tex', {'Enseignants' :  '[enseignants]', 'Content':Content}, lang='latex')
-		runCommand( ["pdflatex", self.name+"-enseignants.tex"], 2 )
+		self.addVariant( 'enseignants', self.name+'-enseignants.tex')
+		# compile les deux versions en même temps (le pdf est exporté ensuite)
+		self.buildVariants()
 		# export to wordpress
 		if options.wordpress:
 			print( " - export to wordpress")
-			content = self.getStringFromTemplate('TP-wp.txt', lang='html', encoding='utf-8')
-			Config.WP.createUpdatePost(title=self.name, content=content, category=Config.WPcategory)
+			for title, content, category in self.posts(options):
+				Config.WP.publish( title, content, category)		# (published at the end of the build, if it has changed)
 		# export files to ssh
 		if options.shared and 'sharedPath' in self.dict:
 			print(" - export files to " + Config.sharedOpt["host"])
@@ -63,18 +65,21 @@ class TP(Session):
 				raise mkcException("The path <sharedPath> should exist to export the files to " + Config.sharedOpt["host"])
 			# remote mkdir
 			runCommand(['ssh', "{user}@{host}".format(**Config.sharedOpt), 'mkdir', '-p', str(self.dict['sharedPath']) ])
-			if 'shared' in self.dict:
-				# copy each file
-				for f in str(self.dict['shared']).split(','):
-					runCommand(['scp', f.strip(), "{user}@{host}:{path}".format( path=str(self.dict['sharedPath']), **Config.sharedOpt ) ])
-			# copy the pdf file
-			runCommand(['scp', self.name+"-eleves.pdf", "{user}@{host}:{path}".format( path=str(self.dict['sharedPath']), **Config.sharedOpt ) ])
+			# copy each file and the pdf file (at the same time)
+			files = [ f.strip() for f in str(self.dict['shared']).split(',') ] if 'shared' in self.dict else []
+			dest = "{user}@{host}:{path}".format( path=str(self.dict['sharedPath']), **Config.sharedOpt )
+			files.append( self.name+"-eleves.pdf")
+			runCommands( [ ['scp', f, dest] for f in files ], labels=[ 'scp '+f for f in files ] )
 		# display correction
 		if options.HTMLcorrection:
 			strHTML = '\n'.join(e.Wordpress() for e in self.iterall('Exercice'))
 			print(strHTML)
 
 			
+	def posts(self, options):
+		return [ (self.name, self.getStringFromTemplate('TP-wp.txt', lang='html', encoding='utf-8'), Config.WPcategory) ]
+
+
 	def files(self, options):
 		listShared = []
 		if 'shared' in self.dict:
@@ -89,15 +94,16 @@ class TD(Session):
 		# met à jour le fichier sty (avec année, etc.)
 		self.writeFileFromTemplate( 'tdtme.sty', 'tdtme.sty')
 		# construit le LaTeX des exercices
+		self.prefetchConversions('latex')
 		Content = '\n'.join( e.LaTeX() for e in self.iterall('Exercice') ) +  self.dict["Content"].convertTo(lang='latex')
 		# construit et compile
 		print( " - build student version")
 		self.writeFileFromTemplate( 'TD.tex', self.name+'-eleves.tex', {'Enseignants' :  '', 'Content':Content}, lang='latex')
-		runCommand( ["pdflatex", self.name+"-eleves.tex"], 2 )
+		self.addVariant( 'eleves', self.name+'-eleves.tex')
 		# construit et compile (version enseignant)
 		print( " - build teacher version")
 		self.writeFileFromTemplate( 'TD.tex', self.name+'-enseignants.tex', {'Enseignants' :  '[enseignants]', 'Content':Content}, lang='latex')
-		runCommand( ["pdflatex", self.name+"-enseignants.tex"], 2 )
+		self.addVariant( 'enseignants', self.name+'-enseignants.tex')
 
 
 		
@@ -114,7 +120,7 @@ class projet(Session):
 		self.writeFileFromTemplate( self.type+'.tex', self.type+'.tex', {}, lang='latex')
 		# met à jour le fichier sty (avec année, etc.)
 		self.writeFileFromTemplate( 'tdtme.sty', 'tdtme.sty')
-		runCommand( ["pdflatex", self.type+".tex"], 2 )
+		self.compileLaTeX( self.type+'.tex')
 		
 	def files(self, options):
 		return [ self.type+".pdf"]
@@ -129,7 +135,7 @@ class DS(Session):
 		self.writeFileFromTemplate( self.type+'.tex', self.type+'.tex', {}, lang='latex')
 		# met à jour le fichier sty (avec année, etc.)
 		self.writeFileFromTemplate( 'tdtme.sty', 'tdtme.sty')
-		runCommand( ["pdflatex", self.type+".tex"], 2 )
+		self.compileLaTeX( self.type+'.tex')
 		
 	def files(self, options):
 		return [ self.type+".pdf"]
@@ -139,10 +145,11 @@ class DS(Session):
 
 class Exercice(Session):
 	"""Définit un exercice"""
+	__slots__ = ()		# (pas de dictionnaire par objet, il peut y avoir des milliers d'exercices)
 	def LaTeX(self):
-		return self.getStringFromTemplate( 'exo.tex', lang='latex' )
+		return self.getStringFromTemplate( 'exo.tex', lang='latex', memoize=True )
 	def Wordpress(self):
-		return self.getStringFromTemplate( 'wordpress.txt', lang='markdown' )
+		return self.getStringFromTemplate( 'wordpress.txt', lang='markdown', memoize=True )
 
 
 
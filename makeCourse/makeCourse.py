@@ -4,24 +4,431 @@
 """
 MakeCourse
 """
+import time
+_startup = [ ('start', time.perf_counter()) ]		# steps of the startup (label, time), see --profile-startup
 import os
+import io
+import sys
+from functools import partial
+from contextlib import redirect_stdout
 from tempfile import mkdtemp
 from colorama import Fore, Style
-from bs4 import BeautifulSoup
-import codecs
-from pickle import dump, load
-from hashlib import md5
+from pickle import dump, load, UnpicklingError
 
-from .osUtils import runCommand, createDirectory, cd
+from . import osUtils
+from .osUtils import createDirectory, removeDirectory, copyFile, cd, workPath, fileHash, splitToComma
 from .mkcException import mkcException
-from .Session import Session, createTagSession
+from .Session import Session, createTagSession, setBytecodeCache, forgetTemplates, importedFiles
+from .xmlTree import parseFile
+from .cache import Cache, hashKey, pruneCache
+from . import profiling
+from .profiling import span
 
 from .config import Config
 from os.path import split
 
 
 print( Fore.RED+"---- MakeCourse v0.5 ----"+Fore.RESET)
+_startup.append( ('import makeCourse', time.perf_counter()) )
+
+
+_trees = Cache('tree', maxsize=4)		# course trees (already parsed and built), with what they depend on
+_treeVersion = 1		# version of the records of the trees (to change when the Tag/Session objects change)
+
+
+def startupStep( label):
+	"""Record the end of a step of the startup (see --profile-startup)"""
+	if _startup is not None:
+		_startup.append( (label, time.perf_counter()) )
+
+
+def startupReport():
+	"""Display the time spent in each step of the startup (from the import of makeCourse to the beginning of the first build)
+	and the modules that are slow to import, that have been imported"""
+	global _startup
+	if _startup is None:
+		return
+	print( Fore.BLUE + "Startup profile:" + Fore.RESET)
+	for (label, t), (_, before) in zip( _startup[1:], _startup):
+		print( "  %-30s %8.1f ms" % (label, 1000*(t-before)) )
+	print( "  %-30s %8.1f ms" % ('total', 1000*(_startup[-1][1]-_startup[0][1])) )
+	heavy = [ m for m in ('pypandoc', 'jinja2', 'lxml', 'bs4', 'asyncio', 'multiprocessing', 'concurrent.futures', 'requests') if m in sys.modules ]
+	print( "  modules imported: " + (", ".join(heavy) or "none") )
+	_startup = None
+
+
+def buildSession( s, basePath, genPath, options):
+	"""Build a session in its temporary (or debug) directory, and copy the produced files at the right place"""
+	#Make one build (TP, course, etc.)
+	print ( Fore.BLUE+"*) Make "+Style.BRIGHT+s.name+Fore.RESET+Style.NORMAL)
+	with span( 'session', s.name):
+		_buildSession( s, basePath, genPath, options)
+
+
+def _buildSession( s, basePath, genPath, options):
+	"""see buildSession"""
+	s.rendered = {}
+	s.variants = []
+
+	# make temp directory (or use the staging one, kept between the runs) and copy all the file in resources dir
+	temporary = False
+	if options.debug:
+		tmp = basePath+"debug/"+s.name+'/'
+		createDirectory(tmp)
+	elif Config.stagePath and options.staging != 'copy':
+		tmp = Config.stagePath+s.name+'/'
+		createDirectory(tmp)
+	else:
+		tmp = mkdtemp()
+		temporary = True
+
+	# remove the outputs of the previous run from a kept directory (otherwise an output that is not produced anymore is still copied)
+	if not temporary:
+		for f in s.files(options):
+			if os.path.lexists( tmp+f):
+				os.remove( tmp+f)
+
+	cd( basePath)
+	s.prepareResources(tmp )
+	cd( tmp)
+
+	# call the custom function associated with the type, to produce the documents (and compile the variants it declares)
+	s.make(options)
+	s.buildVariants()
+
+	# then move the files in the right place (only the ones that changed)
+	outPath = basePath+'/'+genPath.format( **s.dict )
+	for f in s.files(options):
+		createDirectory( outPath)
+		if not os.path.exists( workPath(f)):
+			print( Fore.YELLOW+'The file '+f+' has not been created by '+s.type+' function !'+Fore.RESET)
+		else:
+			copyFile( workPath(f), outPath+f)
+
+	# del the temporary directory
+	if temporary:
+		removeDirectory( tmp)
+
+
+def _buildWorker( basePath, genPath, index):
+	"""Build the index-th session of Session.sessionsToBuild in a worker process
+	and return its index, its output (buffered, so that the outputs of the sessions do not mix), if the build succeeded, the rendered files,
+	what has been profiled and the posts to publish (they are published by the parent)"""
+	s = Session.sessionsToBuild[index]
+	out = io.StringIO()
+	profiling.reset()		# (the spans of the parent are not sent back)
+	osUtils.interactive = False
+	with redirect_stdout(out):
+		try:
+			buildSession( s, basePath, genPath, Config.options)
+		except mkcException as err:
+			print( err )
+			return index, out.getvalue(), False, {}, profiling.collect(), takePosts()
+		except Exception:
+			# (the output of the session is not lost)
+			import traceback
+			traceback.print_exc( file=out)
+			return index, out.getvalue(), False, {}, profiling.collect(), takePosts()
+	return index, out.getvalue(), True, s.rendered, profiling.collect(), takePosts()
+
+
+def takePosts():
+	"""Return (and remove) the posts queued by the sessions for Wordpress (see WP.publish)"""
+	if Config.WP is None:
+		return []
+	posts, Config.WP.queue = Config.WP.queue, []
+	return posts
+
+
+def loadState( stateFile):
+	"""Load the state of the previous run (records of the sessions built, and hashes of the files)"""
+	try:
+		with open( stateFile, "rb") as f:
+			state = load( f )
+	except (IOError, EOFError, UnpicklingError):
+		state = {}
+	if state.get('version') != 2:		# state of an older version of makeCourse
+		state = {'version': 2, 'sessions': {}, 'hashes': {}}
+	return state
+
+
+
+def treeKey( xmlFile, importPaths, commonFiles):
+	"""key of the tree of a course file in the cache (the tree also depends on the import paths, the common files and the session classes)"""
+	return hashKey( _treeVersion, os.path.abspath(xmlFile), Config.options.parser, sorted(importPaths.items()), sorted(commonFiles.items()),
+		sorted( (name, cls.__module__) for name,cls in Config.allSessions.items() ) )
+
+
+def treeDependencies( xmlFile, top):
+	"""Return what the tree of the course depends on: the course file and the imported files (with their hashes)
+	and the directories listed to find the imported files (with their modification time and the patterns matched in them)"""
+	files = { xmlFile: fileHash(xmlFile) }
+	stack = [top]
+	while stack:
+		t = stack.pop()
+		for f in splitToComma( t.tag.get("imported","") ):
+			files[f] = fileHash(f)
+		stack.extend( t.children )
+	directories = { d: (listing[0], dict(listing[3])) for d,listing in osUtils._listings.items() }
+	return files, directories
+
+
+def loadTree( key, xmlFile):
+	"""Load the tree of the course from the cache, if the files and directories it depends on have not changed
+	Restore the list of the sessions to build and the counters of the session types, and return the top Tag (or None)"""
+	try:
+		record = _trees.get(key)
+	except Exception:		# the classes of the sessions may have changed
+		record = None
+	if record is None:
+		return None
+	files, directories, top, sessionsToBuild, numbers = record
+	if any( fileHash(f) != h for f,h in files.items() ):
+		return None
+	for d, (mtime, matches) in directories.items():
+		try:
+			changed = os.stat(d).st_mtime_ns != mtime
+		except OSError:
+			return None
+		# when the directory has changed, the imports are still the same if its patterns match the same entries
+		if changed and any( osUtils.globDirectory(d, p) != m for p,m in matches.items() ):
+			return None
+	Session.sessionsToBuild[:] = sessionsToBuild
+	importedFiles.update( files)
+	for name, number in numbers.items():
+		Config.allSessions[name].number = number
+	if Config.options.verbosity>0:
+		print( Fore.MAGENTA + "> " + xmlFile + " (and its imported files) unchanged, the tree of the course is loaded from the cache" + Fore.RESET)
+	return top
+
+
+def saveTree( key, xmlFile, top):
+	"""Save the tree of the course (with the sessions to build and the counters of the session types) in the cache"""
+	files, directories = treeDependencies( xmlFile, top)
+	numbers = { name: cls.__dict__['number'] for name,cls in Config.allSessions.items() if 'number' in cls.__dict__ }
+	_trees.set( key, (files, directories, top, list(Session.sessionsToBuild), numbers) )
+
+
+
+def resetSessions():
+	"""Forget the sessions already built (list of the sessions to build and counters of the session types)"""
+	del Session.sessionsToBuild[:]
+	for cls in Config.allSessions.values():
+		if 'number' in cls.__dict__:
+			del cls.number
+
+
+
+def buildCourse( xmlFile, genPath, importPaths, commonFiles, basePath, state, stateFile):
+	"""Build the course once: get the tree of the course, and build the sessions (selected by the command line) that changed
+	state is the state of the previous run (updated and saved in stateFile)
+	Returns the top Tag of the tree"""
+	args = Config.args
+	options = Config.options
+	osUtils._createdDirectories.clear()
+	forgetTemplates()
+
+	# clean the debug directory in debug mode
+	if options.debug:
+		if os.path.exists('debug/'):
+			removeDirectory( basePath+'debug/')
+
+	# get the tree of the course from the cache, or open and parse the course file
+	phase = time.perf_counter()
+	key = treeKey( xmlFile, importPaths, commonFiles)
+	top = loadTree( key, xmlFile)
+	if top is None:
+		document = parseFile( xmlFile, 'utf-8')
+
+		# build the recursively the sessions (only the selected ones, when some are selected by the command line)
+		resetSessions()
+		Config.selection = set(args) if args and "all" not in args else None
+		top = createTagSession( document, father=None )		# document.contents[0]
+		if Config.selection is not None:
+			found = { s.name for s in Session.sessionsToBuild } | { s.type for s in Session.sessionsToBuild }
+			if Config.selection - found:
+				# the sessions of an argument have not been found (their name may come from an inherited attribute), so the whole tree is built
+				if options.verbosity>0:
+					print( Fore.MAGENTA + "> " + ", ".join( sorted(Config.selection - found) ) + " not found by name or type, the whole course is built" + Fore.RESET)
+				resetSessions()
+				Config.selection = None
+				top = createTagSession( document, father=None )
+		# (only the whole trees are kept in the cache)
+		if Config.selection is None:
+			saveTree( key, xmlFile, top)
+	sessionsToBuild = Session.sessionsToBuild		# get the list of the sessions object
+	startupStep( 'get the tree of the course')
+	profiling.record( 'phase', 'get the tree of the course', phase, time.perf_counter()-phase)
 
+	"""
+	importFiles( bs.contents[0], importPaths)
+
+	# get the list of sessions we can build (with a 'make' method)
+	buildableSessions = { x.__name__:x for x in Session.__subclasses__() if 'make' in x.__dict__ }
+
+	#This set the PATH for PyDev only...
+	os.environ['PATH'] = os.environ['PATH']+':'+os.getenv('PATH')
+
+
+	# build the list of Sessions to build
+	sessionsToBuild = []
+	for name,session in buildableSessions.items():
+		sessionsToBuild.extend( session(tag, commonFiles) for tag in bs(name) )
+	"""
+	
+	
+
+	for s in sessionsToBuild:
+		s.previous = state['sessions'].get(s.name)
+
+	# only publish the posts of the sessions (without building them)
+	if options.publish:
+		publishSessions( [ s for s in sessionsToBuild if (not args) or ("all" in args) or (s.name in args) or (s.type in args) ], basePath, options)
+		return top
+
+
+	# build every argument in the command line arguments
+	phase = time.perf_counter()
+	somethingHasBeDone = False
+	toBuild = []
+	for s in sessionsToBuild:
+		if (not args) or ("all" in args) or (s.name in args) or (s.type in args):
+			# check if something has to be done
+			if s.shouldBeMake(basePath+'/'+genPath, options) or options.force:
+				toBuild.append(s)
+				if options.explain:
+					print( Fore.BLUE + "*) "+Style.BRIGHT+s.name+Style.NORMAL+" is built: " + (", ".join(s.reasons) or "forced") + Fore.RESET)
+			else:
+				if options.verbosity>0 or options.explain:
+					print( Fore.BLUE + "*) Nothing changed for "+Style.BRIGHT+s.name+Style.NORMAL+", skipped"+Fore.RESET)
+	startupStep( 'check the dependencies')
+	profiling.record( 'phase', 'check the dependencies', phase, time.perf_counter()-phase)
+	if options.profileStartup:
+		startupReport()
+
+	phase = time.perf_counter()
+	built = {}		# session -> files rendered (for the sessions successfully built)
+	if toBuild:
+		somethingHasBeDone = True
+		import multiprocessing
+		if options.jobs>1 and len(toBuild)>1 and 'fork' in multiprocessing.get_all_start_methods():
+			# build the sessions in worker processes, and display their outputs one session at a time
+			sys.stdout.flush()
+			with multiprocessing.get_context('fork').Pool( min(options.jobs, len(toBuild)) ) as pool:
+				worker = partial( _buildWorker, basePath, genPath)
+				for index, out, ok, rendered, profile, posts in pool.imap_unordered( worker, [sessionsToBuild.index(s) for s in toBuild]):
+					print( out, end='')
+					profiling.merge( profile)
+					if posts:
+						Config.WP.queue.extend( posts)
+					if ok:
+						built[ sessionsToBuild[index] ] = rendered
+		else:
+			for s in toBuild:
+				try:
+					buildSession( s, basePath, genPath, options)
+					built[s] = s.rendered
+				except mkcException as err:
+					print( err )
+	cd( basePath)
+	profiling.record( 'phase', 'build the sessions', phase, time.perf_counter()-phase)
+
+	if not somethingHasBeDone:
+		print( Fore.BLUE + "Nothing has changed, nothing to do, so nothing has been done..." + Fore.RESET)
+
+
+	# explain which rendered files (the nodes produced by the templates) have changed since the previous build
+	if options.explain:
+		for s, rendered in built.items():
+			before = s.previous['rendered'] if s.previous else {}
+			changed = sorted( f for f in rendered if rendered[f] != before.get(f) )
+			print( Fore.BLUE + "*) "+Style.BRIGHT+s.name+Style.NORMAL+": " + ("rendered "+", ".join(changed)+" changed" if changed else "the rendered files have not changed") + Fore.RESET)
+
+	# save the state (the sessions that have not been built keep their previous record)
+	for s, rendered in built.items():
+		state['sessions'][s.name] = {'inputs': s.inputs, 'rendered': rendered}
+	# (the hashes of the files that do not exist anymore, like the ones of the temporary build directories, are forgotten)
+	for path in [ p for p in osUtils.fileHashes if not os.path.exists(p) ]:
+		del osUtils.fileHashes[path]
+	with open( stateFile, 'wb') as f:
+		dump( state, f)
+
+	# keep the cache under its maximum size
+	removed = pruneCache( options.cacheSize * 2**20)
+	if removed and options.verbosity>0:
+		print( Fore.MAGENTA + "> " + str(removed) + " files removed from the cache (--cache-size)" + Fore.RESET)
+
+	# publish the posts queued by the sessions (at the same time, once the state is saved, so that a publication error does not lose the build)
+	if Config.WP is not None and Config.WP.queue:
+		with span( 'phase', 'publish'):
+			Config.WP.flush( options.wpJobs, options.force)
+
+	# report what has been profiled (see --profile and --profile-output)
+	if profiling.enabled():
+		if options.profile:
+			profiling.summary()
+		if options.profileOutput:
+			profiling.write( options.profileOutput, options.profileFormat)
+			print( Fore.BLUE + "Profile written in " + options.profileOutput + Fore.RESET)
+		profiling.reset()
+
+	return top
+
+
+
+def publishSessions( sessions, basePath, options):
+	"""Publish the posts of the sessions to Wordpress, without building the sessions (only their posts are rendered)
+	The posts that have not changed since they were published are skipped"""
+	if Config.WP is None:
+		raise mkcException( "There is no Wordpress site to publish to (Config.WP should be set by the course script)")
+	for s in sessions:
+		cd( basePath)
+		for title, content, category in s.posts( options):
+			Config.WP.publish( title, content, category)
+	if not Config.WP.queue:
+		print( Fore.BLUE + "There is no post to publish" + Fore.RESET)
+		return
+	with span( 'phase', 'publish'):
+		Config.WP.flush( options.wpJobs, options.force)
+
+
+
+def watchedFiles( xmlFile, top):
+	"""Return the files the course depends on: the course file, the imported files, and the resources and commonFiles of the sessions to build
+	(the files imported by the previous builds are also watched, since the tree is not complete when a build fails)"""
+	files = {xmlFile} | importedFiles
+	stack = [top] if top else []
+	while stack:
+		t = stack.pop()
+		files.update( splitToComma( t.tag.get("imported","") ) )
+		stack.extend( t.children )
+	for s in Session.sessionsToBuild:
+		files.update( src for src,rel in s.resourceFiles() )
+	return files
+
+
+def snapshot( files):
+	"""Return the modification time and the size of the files (None for the files that do not exist)"""
+	snap = {}
+	for f in files:
+		try:
+			st = os.stat(f)
+			snap[f] = (st.st_mtime_ns, st.st_size)
+		except OSError:
+			snap[f] = None
+	return snap
+
+
+def waitForChanges( xmlFile, top, interval):
+	"""Wait until one of the files the course depends on is modified, created or removed (they are polled every interval seconds)
+	Returns the list of the files changed"""
+	before = snapshot( watchedFiles( xmlFile, top) )
+	print( Fore.BLUE + "Watching " + str(len(before)) + " files (Ctrl-C to stop)..." + Fore.RESET)
+	while True:
+		time.sleep( interval)
+		now = snapshot( watchedFiles( xmlFile, top) )
+		if now != before:
+			return sorted( f for f in set(now) | set(before) if now.get(f) != before.get(f) )
 
 
 
@@ -32,6 +439,8 @@ def makeCourse( xmlFile, genPath, importPaths, commonFiles, rendererContent=True
 		- genPath: path where to put the produced documents
 		- importPaths: schemes to know where to import stuff (dictionnary tags -> path scheme)
 		- commonFiles: schemes to know where to find the commonFiles (dictionary session -> path)
+	With the --watch option, the course is built again each time one of its files is modified
+	(the tree of the course, the caches and the state are kept in memory between the builds)
 	"""
 	try:
 
@@ -42,121 +451,64 @@ def makeCourse( xmlFile, genPath, importPaths, commonFiles, rendererContent=True
 		Config.add_option('-f', '--force', help='Force the generation of the documents, even if nothing changes from last run', dest='force', action='store_true', default=False)
 		Config.add_option('-q', '--quick', help='Quick pdf generation (do not compile twice the latex, do not produce handout, etc.)', dest='quick', action='store_true', default=False)
 		Config.add_option('-w', '--wordpress', help='Publish to wordpress', dest='wordpress', default=False, action='store_true')
+		Config.add_option('--publish', help='Only publish the posts of the sessions to wordpress (the sessions are not built, and the posts that have not changed are not updated)', dest='publish', default=False, action='store_true')
+		Config.add_option('--wp-jobs', help='Number of posts published to wordpress at the same time', dest='wpJobs', default=4, type=int)
 		Config.add_option('-c', '--HTMLcorrection', help='Display an HTML correction', dest='HTMLcorrection', default=False, action='store_true')
 		Config.add_option('-s', '--shared', help='Copy the required files to the <shared> path (via ssh)', default=False,	action='store_true')
+		Config.add_option('-p', '--precompile', help='Precompile the LaTeX preambles (with mylatexformat), and reuse them for the documents that share them', dest='preamble', default=False, action='store_true')
+		Config.add_option('--staging', help='How the resources are put in the build directories: link (hard links, default), symlink or copy (copied in a new temporary directory for each build)', dest='staging', default='link', choices=['link','symlink','copy'])
+		Config.add_option('--cache-size', help='Maximum size (in MB) of the caches stored between the runs (the least recently used entries are removed)', dest='cacheSize', default=1024, type=int)
+		Config.add_option('--no-cache', help='Do not use (nor update) the caches stored between the runs', dest='noCache', default=False, action='store_true')
+		Config.add_option('-e', '--explain', help='Explain why each session is built (or not)', dest='explain', default=False, action='store_true')
+		Config.add_option('--parser', help='Parser of the XML files: lxml (default) or bs4 (BeautifulSoup, slower but more tolerant)', dest='parser', default='lxml', choices=['lxml','bs4'])
+		Config.add_option('--watch', help='Watch the files of the course, and build again the sessions when they change', dest='watch', default=False, action='store_true')
+		Config.add_option('--watch-interval', help='Time (in seconds) between two checks of the files in watch mode', dest='watchInterval', default=0.5, type=float)
+		Config.add_option('--profile', help='Display the time spent in the phases, sessions, renders, pandoc conversions and external commands, and the cache hits', dest='profile', default=False, action='store_true')
+		Config.add_option('--profile-output', help='Write the profile (spans and counters) in the file PROFILE_OUTPUT', dest='profileOutput', default=None)
+		Config.add_option('--profile-format', help='Format of the profile file: json (default) or chrome (Trace Event format, for chrome://tracing or Perfetto)', dest='profileFormat', default='json', choices=['json', 'chrome'])
+		Config.add_option('--profile-startup', help='Display the time spent in each step of the startup (until the first build)', dest='profileStartup', default=False, action='store_true')
+		Config.add_option('-j', '--jobs', help='Number of sessions built at the same time (in worker processes)', dest='jobs', default=1, type=int)
 		Config.parse()
-		args = Config.args
+		startupStep( 'parse the command line')
+		profiling.enable( Config.options.profile or bool(Config.options.profileOutput) )
 		options = Config.options
 		Config.importPaths = importPaths 
 		Config.commonFiles = commonFiles
 		Config.allSessions = { x.__name__:x for x in Session.__subclasses__()}	# list of the created session classes
 		Config.rendererContent = rendererContent
-		
-		# clean the debug directory in debug mode
+		dirName,baseName = split(xmlFile)
+		Config.cachePath = None if options.noCache else os.path.abspath( os.path.join( dirName, '.makeCourse-cache') )+'/'
+		Config.stagePath = Config.cachePath and Config.cachePath+'stage/'+baseName+'/'
+		setBytecodeCache( Config.cachePath and Config.cachePath+'jinja/')
 		basePath = os.path.abspath('.')+'/'			# base path (from where the script is run, because the path are relative)
-		if options.debug:
-			if os.path.exists('debug/'):
-				runCommand(['rm','-rf','debug/'])
-
-		# open and parse the course file
-		with codecs.open(xmlFile, encoding='utf-8') as f:
-			bs = BeautifulSoup(f, features="xml")
-
-
-		# build the recursively the sessions
-		top = createTagSession( bs, father=None )		# bs.contents[0]
-		sessionsToBuild = Session.sessionsToBuild		# get the list of the sessions object
-		
-
-		"""
-		importFiles( bs.contents[0], importPaths)
-
-		# get the list of sessions we can build (with a 'make' method)
-		buildableSessions = { x.__name__:x for x in Session.__subclasses__() if 'make' in x.__dict__ }
-
-		#This set the PATH for PyDev only...
-		os.environ['PATH'] = os.environ['PATH']+':'+os.getenv('PATH')
-
-
-		# build the list of Sessions to build
-		sessionsToBuild = []
-		for name,session in buildableSessions.items():
-			sessionsToBuild.extend( session(tag, commonFiles) for tag in bs(name) )
-		"""
-		
-		
-
-		# if possible, load the previous xml file, and look for the differences
-		dirName,baseName = split(xmlFile) 
-		try:
-			with open(dirName+"/."+baseName+".makeCourse", "rb") as f:
-				data = load( f )
-				for s in sessionsToBuild:
-					if s.name in data:
-						s.checkDifferences( data[s.name] )
-		except IOError:
-			pass
-
-
-		# build every argument in the command line arguments
-		somethingHasBeDone = False
-		for s in sessionsToBuild:
-			if (not args) or ("all" in args) or (s.name in args) or (s.type in args):
-				
-				cd( basePath)
-				
-				# check if something has to be done
-				if s.shouldBeMake(basePath+'/'+genPath, options) or options.force:
-					somethingHasBeDone = True
-
-					#Make one build (TP, course, etc.)
-					print ( Fore.BLUE+"*) Make "+Style.BRIGHT+s.name+Fore.RESET+Style.NORMAL)
-
-					# make temp directory and copy all the file in resources dir
-					if options.debug:
-						tmp = "debug/"+s.name+'/'
-						createDirectory(tmp)
-					else:
-						tmp = mkdtemp()
-
-					s.prepareResources(tmp )
-					cd( tmp)
-
-					# call the custom function associated with the type, to produce the documents
-					s.make(options)
-
-					# then move the files in the right place
-					for f in s.files(options):
-						createDirectory( basePath+'/'+genPath.format( **s.dict ) )
-						newFile = basePath+'/'+genPath.format( **s.dict )+f
-						if not os.path.exists(f):
-							print( Fore.YELLOW+'The file '+f+' has not been created by '+s.type+' function !'+Fore.RESET)
-						runCommand( ['cp', f, newFile])
-
-					# del the temporary directory or clean debug directory
-					if not options.debug:
-						runCommand( ['rm', '-rf', tmp])
-				else:
-					if options.verbosity>0:
-						print( Fore.BLUE + "*) Nothing changed for "+Style.BRIGHT+s.name+Style.NORMAL+", skipped"+Fore.RESET)
-
-
-
-		if not somethingHasBeDone:
-			print( Fore.BLUE + "Nothing has changed, nothing to do, so nothing has been done..." + Fore.RESET)
-
-
-		# save the data file
-		data = {L.name: {key:md5(str(val).encode('utf-8')).hexdigest() for key,val in L.dict.items()} for L in sessionsToBuild }
-		cd( basePath)
-		with open(dirName+"/."+baseName+".makeCourse", 'wb') as f:
-			dump( data, f)
-
-
-
-
-
 
+		# if possible, load the state of the previous run (the records of the sessions previously built, and the hashes of the files)
+		stateFile = os.path.join( dirName, "."+baseName+".makeCourse")
+		state = loadState( stateFile)
+		osUtils.fileHashes = state['hashes']
+		startupStep( 'load the state')
+
+		if not options.watch:
+			buildCourse( xmlFile, genPath, importPaths, commonFiles, basePath, state, stateFile)
+			return
+
+		# watch mode: build, and build again when something changes (an error does not stop the watch)
+		top = None
+		while True:
+			try:
+				top = buildCourse( xmlFile, genPath, importPaths, commonFiles, basePath, state, stateFile)
+			except mkcException as err:
+				print( err )
+			except Exception:
+				import traceback
+				traceback.print_exc()
+			changed = waitForChanges( xmlFile, top, options.watchInterval)
+			print( Fore.BLUE + "Changed: " + ", ".join(changed) + Fore.RESET)
 
 	except mkcException as err:
 		print( err )
+	except KeyboardInterrupt:
+		if Config.options and Config.options.watch:
+			print( Fore.BLUE + "Stop watching" + Fore.RESET)
+		else:
+			raise
@@ -1,15 +1,30 @@
-from glob import glob
-from subprocess import Popen, PIPE, call, list2cmdline
+from subprocess import list2cmdline
 from colorama import Fore
 import os
+import sys
+import time
 from collections import deque
 from .config import Config
+from .mkcException import mkcException
+from . import profiling
 import re
 import unicodedata
 import platform
+import shutil
+import filecmp
+import fnmatch
+from hashlib import md5
 
 
 regex_comma = re.compile(r'''((?:[^,"']|"[^"]*"|'[^']*')+)''')
+regex_magic = re.compile(r'[*?[]')		# special characters of the glob patterns
+
+_workDir = None		# working directory of the build (None for the current directory of the process), see cd()
+interactive = True		# False when the outputs are buffered (worker processes): the commands cannot read stdin (LaTeX does not wait at an invisible prompt)
+fileHashes = {}		# memo of the hashes of the files: path -> (size, modification time, hash), kept between the runs
+_tools = {}			# identity of the tools (see toolIdentity)
+_createdDirectories = set()		# directories already created (or checked) by createDirectory
+_listings = {}			# listings of the directories: path -> (modification time, list of the entries, set of the entries, patterns matched), see listDirectory
 
 #http://stackoverflow.com/questions/5581857/git-and-the-umlaut-problem-on-mac-os-x
 if platform.system()=='Darwin':
@@ -24,57 +39,308 @@ def splitToComma( text):
 	return [ st.strip(' \'\"') for st in regex_comma.split(text)[1::2] ]
 
 
-def runCommand( cmd, times=1, charError = '!'):
+class CommandResult(object):
+	"""Result of a command run by runCommand/runCommands"""
+	def __init__(self, cmd, returncode, duration, lastLines):
+		self.cmd = cmd					# command line (list)
+		self.returncode = returncode	# exit status
+		self.duration = duration		# wall time (in seconds)
+		self.lastLines = lastLines		# last lines of its output (stdout and stderr)
+
+
+def display( line):
+	"""print a line in one write (so that the lines printed at the same time by several threads do not merge)"""
+	sys.stdout.write( line + '\n')
+
+
+async def _runCommand( cmd, charError, prefix):
+	"""run a shell command, stream its stdout and stderr at the same time and return its CommandResult
+	The stdout is only displayed from the first line starting with charError (with the 10 lines before), or in verbose mode,
+	the stderr is always displayed"""
+	import asyncio
+	start = time.perf_counter()
+	# (the limit of the length of the lines read is raised from 64 KiB, some commands write very long lines)
+	proc = await asyncio.create_subprocess_shell( list2cmdline(cmd), stdin=None if interactive else asyncio.subprocess.DEVNULL,
+	                                              stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=_workDir, limit=2**26)
+	last10 = deque( maxlen=10)		# last 10 lines (not displayed yet)
+	lastLines = deque( maxlen=10)	# last 10 lines
+	shown = [ Config.options.verbosity>1 ]
+
+	async def read( stream, isError):
+		while True:
+			line = await stream.readline()
+			if not line:
+				break
+			line = prefix + line.decode("utf-8", errors="replace").rstrip()
+			lastLines.append(line)
+			# start to display when output starts with '!' (for LaTeX errors)
+			if not shown[0] and not isError and line[len(prefix):].startswith(charError):
+				shown[0] = True
+				for l in last10:
+					display( l )
+				last10.clear()
+			if shown[0] or isError:
+				display( line )
+			else:
+				last10.append(line)
+
+	await asyncio.gather( read(proc.stdout, False), read(proc.stderr, True) )
+	returncode = await proc.wait()
+	result = CommandResult( cmd, returncode, time.perf_counter()-start, list(lastLines) )
+	profiling.record( 'command', list2cmdline(cmd), start, result.duration)
+	if Config.options.verbosity>1:
+		display( Fore.MAGENTA + prefix + '(exit status ' + str(returncode) + ', ' + '%.2fs' % result.duration + ')' + Fore.RESET)
+	return result
+
+
+def _checkResults( results, displayed):
+	"""raise an exception if one of the commands failed"""
+	failed = [ r for r in results if r.returncode != 0 ]
+	if failed:
+		msg = '\n'.join( "The command '" + list2cmdline(r.cmd) + "' failed (exit status " + str(r.returncode) + ")"
+		                  + ( '' if displayed else ':\n' + '\n'.join(r.lastLines) ) for r in failed )
+		raise mkcException( msg )
+
+
+def runCommand( cmd, times=1, charError = '!', prefix=''):
 	"""run shell command, several times
-	(and manage the errors)"""
-	last10 = deque(10*[''], 10)# last 10 lines
+	(and manage the errors: an exception is raised if the command fails)
+	prefix is put in front of each line displayed
+	Returns the CommandResult of the last run"""
 	if Config.options.verbosity>0:
-		print  (Fore.MAGENTA+'> '+list2cmdline(cmd)+Fore.RESET)
+		display( Fore.MAGENTA+prefix+'> '+list2cmdline(cmd)+Fore.RESET)
+	import asyncio
 	for i in range(times):
-		proc = Popen( list2cmdline(cmd), stdout=PIPE, shell=True)
-		display = False
-		line = 'toto'
-		while line:
-			line = proc.stdout.readline().decode("utf-8")
-			last10.pop()
-			last10.appendleft(line)
-			# start to display when output starts with '!' (for LaTeX errors)
-			display = display or line.startswith(charError)
-			if display or Config.options.verbosity>1:
-				if len(last10)>1:
-					print( ''.join(last10).rstrip() )
-					last10.clear()
-					last10.appendleft(line)
-				else:
-					print( line.rstrip())
+		result = asyncio.run( _runCommand( cmd, charError, prefix) )
+		_checkResults( [result], Config.options.verbosity>1 )
+	return result
+
+
+def runCommands( cmds, labels=None, charError = '!'):
+	"""run several shell commands at the same time
+	their outputs are displayed on the same console, each line prefixed by the label of its command
+	(by default, the name of the command and its last argument)
+	An exception is raised (once they are all finished) if one of them fails
+	Returns the list of CommandResult"""
+	if labels is None:
+		labels = [ cmd[0] + ' ' + os.path.basename(cmd[-1]) for cmd in cmds ]
+	width = max( [len(l) for l in labels] or [0] )
+	if Config.options.verbosity>0:
+		for cmd in cmds:
+			print  (Fore.MAGENTA+'> '+list2cmdline(cmd)+' &'+Fore.RESET)
+
+	import asyncio
+
+	async def runAll():
+		return await asyncio.gather( *( _runCommand( cmd, charError, l.ljust(width)+' | ') for cmd,l in zip(cmds,labels) ) )
+
+	results = asyncio.run( runAll() )
+	_checkResults( results, Config.options.verbosity>1 )
+	return results
+
+
+# auxiliary files of a LaTeX compilation (when they change, the compilation should be run again)
+auxExtensions = ( '.aux', '.toc', '.out', '.nav', '.snm', '.lof', '.lot' )
+# messages of the log asking to run LaTeX again
+regex_rerun = re.compile( r'Rerun to get|Label\(s\) may have changed|Please rerun|Rerun LaTeX')
+
+
+def stageFiles( files, dest, mode='link'):
+	"""Stage files in the dest folder with hard links ('link' mode), symbolic links ('symlink') or copies ('copy')
+	- files: list of (source path, destination path relative to dest)
+	The files already staged (and unchanged) are left untouched, and the files previously staged that are not in the list anymore are removed
+	(a hard link that cannot be done, for example across devices, is replaced by a copy)"""
+	symbolic = mode == 'symlink'
+	manifest = os.path.join( dest, '.staged')
+	try:
+		with open(manifest) as f:
+			previous = set( f.read().splitlines() )
+	except IOError:
+		previous = set()
+	staged = set()
+	refreshed = 0
+	for src, rel in files:
+		staged.add(rel)
+		target = os.path.join( dest, rel)
+		if symbolic:
+			src = os.path.abspath(src)
+			if os.path.islink(target) and os.readlink(target) == src:
+				continue
+		elif os.path.isfile(target) and not os.path.islink(target):
+			st, stTarget = os.stat(src), os.stat(target)
+			if (st.st_dev, st.st_ino) == (stTarget.st_dev, stTarget.st_ino) or (st.st_size, st.st_mtime_ns) == (stTarget.st_size, stTarget.st_mtime_ns):
+				continue
+		if os.path.lexists(target):
+			os.remove(target)
+		os.makedirs( os.path.dirname(target), exist_ok=True)
+		if symbolic:
+			os.symlink( src, target)
+		elif mode == 'copy':
+			shutil.copy2( src, target)
+		else:
+			try:
+				os.link( src, target)
+			except OSError:
+				shutil.copy2( src, target)
+		refreshed += 1
+	for rel in previous - staged:
+		if os.path.lexists( os.path.join(dest, rel) ):
+			os.remove( os.path.join(dest, rel) )
+	with open(manifest, 'w') as f:
+		f.write( '\n'.join( sorted(staged) ) )
+	if Config.options.verbosity>0:
+		print( Fore.MAGENTA + '> stage ' + str(len(staged)) + ' files in ' + dest + ' (' + str(refreshed) + ' refreshed)' + Fore.RESET)
+
+
+def runLaTeX( texFile, maxPasses=3, command='pdflatex', fmt=None, prefix=''):
+	"""Run LaTeX on texFile until its output is settled, but at most maxPasses times
+	(LaTeX is run again only when its log asks for it or when one of its auxiliary files changed during the pass)
+	fmt is the name of a precompiled format to use (None for the default one)
+	prefix is put in front of each line displayed
+	Returns the number of passes"""
+	base = os.path.splitext(texFile)[0]
+
+	def auxHashes():
+		hashes = {}
+		for ext in auxExtensions:
+			try:
+				with open( workPath(base+ext), 'rb') as f:
+					hashes[ext] = md5( f.read() ).hexdigest()
+			except IOError:
+				pass
+		return hashes
+
+	for nbPasses in range( 1, maxPasses+1):
+		before = auxHashes()
+		runCommand( [command] + (['-fmt='+fmt] if fmt else []) + [texFile], prefix=prefix )
+		if nbPasses < maxPasses:
+			try:
+				with open( workPath(base+'.log'), encoding='latin-1') as f:
+					log = f.read()
+			except IOError:
+				log = ''
+			if not regex_rerun.search(log) and auxHashes() == before:
+				break
+	if Config.options.verbosity>0:
+		display( Fore.MAGENTA + prefix + '  ('+texFile+' compiled in '+str(nbPasses)+' pass'+('es' if nbPasses>1 else '')+')' + Fore.RESET)
+	return nbPasses
 
 
 def cd( path):
-	"""Change directory"""
+	"""Change the working directory of the build
+	(only the commands run by runCommand and the files given to workPath are concerned, the process directory is left untouched,
+	so that several builds can run at the same time in worker processes)"""
+	global _workDir
 	if Config.options.verbosity>0:
 		print( Fore.MAGENTA+ '> cd '+path+Fore.RESET)
-	os.chdir(path)
+	_workDir = os.path.abspath(path)
+
+
+def workPath( fileName):
+	"""Return the path of fileName (relative to the working directory of the build, see cd)"""
+	return os.path.join(_workDir, fileName) if _workDir else fileName
+
 
-#TODO: "mkdir -p" could do the same... 
 # noinspection PyShadowingBuiltins
 def createDirectory( dir):
 	"""Do the necessary to create directory (or do nothing if it exists)
-	works with xxx/yyy/zzz even if xxx or xxx/yyy do not exist"""
-	ldir = dir.split('/')
-	d = ''
-	for sd in ldir:
-		d = d + sd + '/'
-		if not os.path.exists(d):
+	works with xxx/yyy/zzz even if xxx or xxx/yyy do not exist
+	(a directory is only checked once per run)"""
+	if dir not in _createdDirectories:
+		if not os.path.isdir(dir):
 			if Config.options.verbosity>0:
-				print( Fore.MAGENTA+"> mkdir "+d+Fore.RESET)
-			os.mkdir(d)
+				print( Fore.MAGENTA+"> mkdir -p "+dir+Fore.RESET)
+			os.makedirs( dir, exist_ok=True)
+		_createdDirectories.add(dir)
 
 
 # noinspection PyShadowingBuiltins
-def getPathTime(dir):
-	"""Get the latest time of all the files of a directory (and subdirectory)"""
-	pathTimes = [ os.path.getmtime( os.path.join(root,f) ) for root, subFolders, files in os.walk(dir) for f in files ]
-	return pathTimes and max( pathTimes ) or 0
+def removeDirectory( dir):
+	"""Remove a directory and all its content"""
+	if Config.options.verbosity>0:
+		print( Fore.MAGENTA+"> rm -rf "+dir+Fore.RESET)
+	shutil.rmtree( dir, ignore_errors=True)
+	_createdDirectories.difference_update( [d for d in _createdDirectories if d.startswith(dir)] )
+
+
+def copyFile( src, dest):
+	"""Copy the file src to dest, unless dest already has the same content
+	Returns True if the file has been copied"""
+	if os.path.isfile(dest) and filecmp.cmp( src, dest, shallow=False):
+		return False
+	if Config.options.verbosity>0:
+		print( Fore.MAGENTA+"> cp "+src+" "+dest+Fore.RESET)
+	shutil.copyfile( src, dest)
+	return True
+
+
+def fileHash(path):
+	"""Get the md5 hash of the content of a file (None if the file does not exist)
+	The hash is only computed again when the size or the modification time of the file changes"""
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	memo = fileHashes.get(path)
+	if memo and memo[0]==st.st_size and memo[1]==st.st_mtime_ns:
+		return memo[2]
+	h = md5()
+	with open(path, 'rb') as f:
+		for chunk in iter( lambda: f.read(1<<20), b''):
+			h.update(chunk)
+	fileHashes[path] = (st.st_size, st.st_mtime_ns, h.hexdigest())
+	return h.hexdigest()
+
+
+def toolIdentity(name):
+	"""Get a string that identifies the installed version of a tool (from the path, size and modification time of its executable)
+	without running it"""
+	if name not in _tools:
+		path = shutil.which(name)
+		if path:
+			st = os.stat(path)
+			_tools[name] = path + ':' + str(st.st_size) + ':' + str(st.st_mtime_ns)
+		else:
+			_tools[name] = 'not found'
+	return _tools[name]
+
+
+def listDirectory( path):
+	"""Return the entries of the directory path, as a list and a set, and the dictionary of the patterns already matched (or None if path is not a directory)
+	The listings are kept, and the directory is listed again only when its modification time changes"""
+	try:
+		mtime = os.stat(path).st_mtime_ns
+	except OSError:
+		return None
+	listing = _listings.get(path)
+	if listing is None or listing[0] != mtime:
+		try:
+			names = os.listdir(path)
+		except OSError:
+			return None
+		listing = (mtime, names, set(names), {})
+		_listings[path] = listing
+	return listing[1:]
+
+
+def globDirectory( directory, pattern):
+	"""Return the names of the entries of directory that match the pattern
+	(same as glob(directory+'/'+pattern), but from the listing of the directory, see listDirectory)"""
+	if not pattern:
+		# (glob('dir/') gives 'dir/' when dir is a directory)
+		return [''] if directory and os.path.isdir(directory) else []
+	directory = directory or '.'
+	listing = listDirectory( directory)
+	if listing is None:
+		return []
+	names, nameSet, matches = listing
+	if pattern not in matches:
+		if not regex_magic.search(pattern):
+			matches[pattern] = [pattern] if pattern in nameSet or os.path.lexists( os.path.join(directory, pattern) ) else []
+		else:
+			# (like glob, the hidden files only match the patterns starting with a dot)
+			matches[pattern] = [ n for n in fnmatch.filter( names, pattern) if pattern[0] == '.' or n[0] != '.' ]
+	return list( matches[pattern] )
 
 
 def fileAlmostExists(fileNamePath, extension='*'):
@@ -92,10 +358,10 @@ def fileAlmostExists(fileNamePath, extension='*'):
 			# need to denormalize unicode string to be able to search for filename with accents
 			# see http://nedbatchelder.com/blog/201106/filenames_with_accents.html
 			# and http://stackoverflow.com/questions/14185114/pythons-glob-module-and-unix-find-command-dont-recognize-non-ascii
-			denorm = unicodedata.normalize(unicode_normalization, "/".join(partial+[p])+pr )
-			res = glob( denorm )
+			denorm = unicodedata.normalize(unicode_normalization, p+pr )
+			res = globDirectory( "/".join(partial), denorm )
 			if len(res)==1:
-				partial.append( res[0].split("/")[-1] )		# append the last part of the path
+				partial.append( res[0] )		# append the last part of the path
 				break
 		else:
 			return None
@@ -0,0 +1,137 @@
+"""
+	Instrumentation of the runs (options --profile and --profile-output)
+
+	The phases, sessions and external commands are recorded as spans (category, name, start, duration),
+	and the frequent events (pandoc calls, cache hits, etc.) as counters (number and cumulative time)
+	Nothing is recorded (and the cost is only a test) when the profiling is not enabled
+"""
+
+import os
+import time
+import json
+import threading
+from colorama import Fore
+
+_enabled = False
+_spans = []			# recorded spans: (category, name, start, duration, pid, tid)
+_counters = {}		# counters: name -> [number, cumulative time]
+
+
+def enable( on=True):
+	"""Enable (or disable) the profiling"""
+	global _enabled
+	_enabled = on
+
+
+def enabled():
+	return _enabled
+
+
+class _Span(object):
+	"""Context manager that records a span"""
+	__slots__ = ('category', 'name', 'start')
+
+	def __init__(self, category, name):
+		self.category = category
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		record( self.category, self.name, self.start, time.perf_counter()-self.start)
+		return False
+
+
+class _NoSpan(object):
+	"""Context manager that does nothing (when the profiling is not enabled)"""
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+_noSpan = _NoSpan()
+
+
+def span( category, name):
+	"""Return a context manager that records the time spent in its block, as a span of the category
+	ex: with span('session', s.name): ..."""
+	return _Span( category, name) if _enabled else _noSpan
+
+
+def record( category, name, start, duration):
+	"""Record a span (its start is given by time.perf_counter())"""
+	if _enabled:
+		_spans.append( (category, name, start, duration, os.getpid(), threading.get_ident()) )
+
+
+def count( name, duration=0.0):
+	"""Increment a counter (and add the duration to its cumulative time)"""
+	if _enabled:
+		c = _counters.setdefault( name, [0, 0.0])
+		c[0] += 1
+		c[1] += duration
+
+
+def reset():
+	"""Forget the spans and counters recorded"""
+	del _spans[:]
+	_counters.clear()
+
+
+def collect():
+	"""Return the spans and counters recorded (to be merged in another process, see merge)"""
+	return list(_spans), { name: list(c) for name,c in _counters.items() }
+
+
+def merge( data):
+	"""Merge the spans and counters recorded by another process (see collect)"""
+	spans, counters = data
+	_spans.extend( spans)
+	for name, (n, duration) in counters.items():
+		c = _counters.setdefault( name, [0, 0.0])
+		c[0] += n
+		c[1] += duration
+
+
+def summary( slowest=10):
+	"""Display a summary of the spans (per category) and of the counters, and the slowest spans"""
+	print( Fore.BLUE + "Profile:" + Fore.RESET)
+	categories = {}
+	for category, name, start, duration, pid, tid in _spans:
+		c = categories.setdefault( category, [0, 0.0, 0.0])
+		c[0] += 1
+		c[1] += duration
+		c[2] = max( c[2], duration)
+	print( "  %-28s %8s %12s %12s" % ('category', 'number', 'total (ms)', 'max (ms)') )
+	for category, (n, total, longest) in sorted( categories.items(), key=lambda x: -x[1][1]):
+		print( "  %-28s %8d %12.1f %12.1f" % (category, n, 1000*total, 1000*longest) )
+	if _counters:
+		print( "  %-28s %8s %12s" % ('counter', 'number', 'total (ms)') )
+		for name, (n, total) in sorted( _counters.items() ):
+			print( "  %-28s %8d %12.1f" % (name, n, 1000*total) )
+	if _spans and slowest:
+		print( "  slowest:" )
+		for category, name, start, duration, pid, tid in sorted( _spans, key=lambda s: -s[3])[:slowest]:
+			print( "  %10.1f ms  %s %s" % (1000*duration, category, name) )
+
+
+def write( fileName, fmt='json'):
+	"""Write the spans and counters in a file, as a JSON report or as a Chrome trace (fmt='chrome', for chrome://tracing or Perfetto)"""
+	start = min( [s[2] for s in _spans] or [0.0] )
+	if fmt == 'chrome':
+		events = [ {'name': name, 'cat': category, 'ph': 'X', 'ts': 1e6*(t-start), 'dur': 1e6*duration, 'pid': pid, 'tid': tid}
+		           for category, name, t, duration, pid, tid in _spans ]
+		report = {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'counters': _counters} }
+	else:
+		report = {
+			'spans': [ {'category': category, 'name': name, 'start': t-start, 'duration': duration, 'pid': pid, 'tid': tid}
+			           for category, name, t, duration, pid, tid in _spans ],
+			'counters': { name: {'number': n, 'time': total} for name, (n, total) in _counters.items() }
+		}
+	with open( fileName, 'w') as f:
+		json.dump( report, f, indent=1)
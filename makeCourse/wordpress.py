@@ -7,11 +7,33 @@
 	
 """
 
+import os
+import threading
 import requests
 from colorama import Fore
 from .config import Config
 from getpass import getpass
 from .mkcException import mkcException
+from .cache import Cache, hashKey
+from .profiling import span
+
+
+_sessions = {}		# HTTP session (with its pool of connections) of each process, see session()
+_published = Cache('posts')		# posts published (key: site, category, title), with their id, the hash of their content and their modification date
+
+
+def session():
+	"""Return the HTTP session of the process (its connections are kept alive and reused by the requests, also from several threads)"""
+	s = _sessions.get( os.getpid() )
+	if s is None:
+		# (a forked process gets its own session, the connections of its parent are not shared)
+		s = requests.Session()
+		adapter = requests.adapters.HTTPAdapter( pool_connections=4, pool_maxsize=max( 4, getattr( Config.options, 'wpJobs', 4) ) )
+		s.mount( 'http://', adapter)
+		s.mount( 'https://', adapter)
+		_sessions.clear()
+		_sessions[ os.getpid() ] = s
+	return s
 
 
 def getRequest(url, **params):
@@ -19,50 +41,56 @@ def getRequest(url, **params):
 	# prepare request
 	req = requests.Request('GET', url, params=params)
 	prepared = req.prepare()
-	# pretty-print url (if needed)
-	if Config.options.verbosity>0:
-		print( Fore.GREEN + '> GET ' + prepared.url + Fore.RESET, end='')
 	
-	# get request
-	s = requests.Session()
-	r = s.send(prepared)
+	# get request (through the pooled connections)
+	with span( 'request', prepared.url.split('?')[0]):
+		r = session().send(prepared)
 	
-	# pretty-print status (if needed)
+	# pretty-print url and status (if needed, in one print, since the requests may be done by several threads)
 	if r.status_code == requests.codes.ok and r.json()['status']=='ok':
 		if Config.options.verbosity>0:
-				print( '  (status=' + Fore.GREEN + 'ok' + Fore.RESET + ')')
+			print( Fore.GREEN + '> GET ' + prepared.url + Fore.RESET + '  (status=' + Fore.GREEN + 'ok' + Fore.RESET + ')')
 		if Config.options.verbosity>1:
 			print( Fore.MAGENTA+ '>>> ' + str(r.json()) + Fore.RESET )
 	elif r.status_code != requests.codes.ok:
 		if Config.options.verbosity>0:
-			print( '  (status=' + Fore.RED + 'ko' + Fore.RESET + ')')
+			print( Fore.GREEN + '> GET ' + prepared.url + Fore.RESET + '  (status=' + Fore.RED + 'ko' + Fore.RESET + ')')
 		if Config.options.verbosity>1:
 			print( Fore.MAGENTA + '>>> ' + r.reason + ': ' + r.text + Fore.RESET)
 		raise mkcException( 'Get request impossible\nRequest='+r.url+'\nReason='+r.reason + ': ' + r.text)
 	else:
 		if Config.options.verbosity>0:
-			print( '  (status=' + Fore.RED + 'ko' + Fore.RESET + ')')
+			print( Fore.GREEN + '> GET ' + prepared.url + Fore.RESET + '  (status=' + Fore.RED + 'ko' + Fore.RESET + ')')
 		if Config.options.verbosity>1:
 			print( Fore.MAGENTA + '>>> ' + str(r.json()) + Fore.RESET)
-		raise mkcException( 'Get request impossible\nRequest='+r.url+'\nAnswer='+str(r.json()))
+		err = mkcException( 'Get request impossible\nRequest='+r.url+'\nAnswer='+str(r.json()))
+		err.answer = r.json()		# (to know the error given by the site, see WP.getWPRequest)
+		raise err
 			
 		
 	return r
 	
 
 class WP:
+	"""Client of a Wordpress site
+	The connections, the authentication cookie and the nonces are reused by the requests, and the posts of a category
+	are fetched once (as an index title -> id)
+	The posts can be published at the same time (see publish and flush)
+	A post is not updated when it has not changed since it was published (its content is the same, and it has not been
+	modified online since)"""
 	
 	def __init__(self, url, user, password=None):
 		"""store id to connect to wordpress site
-		if password=None, it will be asked for the 1st request"""
+		(the authentication is done by the 1st request; if password=None, it will be asked then)"""
 		self.url = url
 		self.user = user
 		self.password = password
 		self.cookie = None
-
-		
-		if password:
-			self.getCookie()
+		self.nonces = {}		# nonce of each (controller, method)
+		self.index = {}			# posts of each category already fetched: category -> {title: [ids]}
+		self.modified = {}		# modification date of the posts fetched: id -> date
+		self.queue = []			# posts to publish (see publish and flush)
+		self._lock = threading.RLock()
 	
 	
 	def getCookie(self):
@@ -73,20 +101,39 @@ class WP:
 		self.cookie = r.json()['cookie']
 
 	
+	def getNonce(self, controller, method):
+		"""Return the nonce of the method (it is only asked once, and then reused)"""
+		nonce = self.nonces.get( (controller, method) )
+		if nonce is None:
+			with self._lock:		# (asked by one thread only)
+				nonce = self.nonces.get( (controller, method) )
+				if nonce is None:
+					r = getRequest( self.url, controller=controller, method=method, json='get_nonce', cookie=self.cookie)
+					nonce = self.nonces[ (controller, method) ] = r.json()['nonce']
+		return nonce
+
+	
 	def getWPRequest(self, controller, method, **params):
 		"""Get request
 		ask the user for the password for the 1st request if it were not given to the constructor"""
 		# get the cookie if the authentification is not yet been done
-		if not self.cookie:
-			print("Enter the password to log in to "+self.url+' (user='+self.user+'): ')
-			self.password = getpass()
-			self.getCookie()
-		# get nonce
-		r = getRequest( self.url, controller=controller, method=method, json='get_nonce', cookie=self.cookie)
-		nonce = r.json()['nonce']
-		# proceed request
-		params.update({'json':method,'nonce':nonce,'cookie':self.cookie} )
-		r = getRequest( self.url, **params) 
+		with self._lock:
+			if not self.cookie:
+				if not self.password:
+					print("Enter the password to log in to "+self.url+' (user='+self.user+'): ')
+					self.password = getpass()
+				self.getCookie()
+		# proceed request (with the nonce previously get, or a new one if it has expired)
+		params.update({'json':method,'nonce':self.getNonce( controller, method),'cookie':self.cookie} )
+		try:
+			r = getRequest( self.url, **params)
+		except mkcException as err:
+			# (only an error about the nonce is retried, with a new nonce)
+			if 'nonce' not in str( getattr( err, 'answer', {}).get('error', '') ):
+				raise
+			self.nonces.pop( (controller, method), None)
+			params['nonce'] = self.getNonce( controller, method)
+			r = getRequest( self.url, **params)
 		return r.json()
 		
 		
@@ -97,7 +144,12 @@ class WP:
 			content: the post content
 			author: the post's author (login name), default is the current logged in user
 		"""
-		return self.getWPRequest( 'posts', 'create_post', title=title, content=content, status=status, categories=categories, tag=tag)
+		r = self.getWPRequest( 'posts', 'create_post', title=title, content=content, status=status, categories=categories, tag=tag)
+		# the new post is added to the index of its category
+		if categories in self.index and 'post' in r:
+			self.index[categories].setdefault( title, []).append( r['post']['id'] )
+			self.modified[ r['post']['id'] ] = r['post'].get('modified')
+		return r
 
 
 	def updatePost(self, id, title, content, status="publish", categories="", tag=""):
@@ -108,14 +160,30 @@ class WP:
 			content: the post content
 			author: the post's author (login name), default is the current logged in user
 		"""
-		print("'"+content+"'")
 		return self.getWPRequest( 'posts', 'update_post', id=id, title=title, content="'"+content+"'", status=status, categories=categories, tag=tag)
 
 
+	def postIndex(self, category):
+		"""Return the posts of the category, as a dictionary title -> list of ids
+		(all the pages of posts are fetched, once)"""
+		with self._lock:
+			if category not in self.index:
+				index = {}
+				page, pages = 1, 1
+				while page <= pages:
+					r = self.getWPRequest('core','get_posts', category_name=category, count=100, page=page)
+					for p in r['posts']:
+						index.setdefault( p['title'], []).append( p['id'] )
+						self.modified[ p['id'] ] = p.get('modified')
+					pages = r.get('pages', 1)
+					page += 1
+				self.index[category] = index
+			return self.index[category]
+
+
 	def getId(self, title, category):
 		
-		r = self.getWPRequest('core','get_posts', category_name=category)
-		l = [ p['id'] for p in r['posts'] if p['title']==title ]
+		l = self.postIndex( category).get( title, [])
 		
 		if len(l)==1:
 			return l[0]
@@ -125,12 +193,68 @@ class WP:
 			raise mkcException("Several posts exists with title="+title+" and category="+category)
 		
 		
-	def createUpdatePost(self, title, content, category, status="publish", tag=""):
+	def createUpdatePost(self, title, content, category, status="publish", tag="", force=False):
+		"""Create the post, or update it if it exists and has changed (or if force is True)
+		Returns True if the post has been created or updated, False if it has not changed"""
 		
-		# check if the post already exists
-		id = self.getId( title, category)
-		if id==0:
-			self.createPost(title, content, status, category, tag)
-		else:
-			self.updatePost(id, title, content, status, category, tag)
-		
\ No newline at end of file
+		with span( 'publish', title):
+			# check if the post already exists
+			id = self.getId( title, category)
+			key = hashKey( self.url, category, title)
+			digest = hashKey( content, status, tag)
+			record = _published.get( key)
+			# (the modification date is only checked when the site gave it)
+			if id and not force and record and record['id']==id and record['hash']==digest and record['modified'] in (None, self.modified.get(id)):
+				if Config.options.verbosity>0:
+					print( Fore.BLUE + "  The post '" + title + "' has not changed" + Fore.RESET)
+				return False
+			if id==0:
+				r = self.createPost(title, content, status, category, tag)
+			else:
+				r = self.updatePost(id, title, content, status, category, tag)
+			post = r.get('post', {})
+			_published.set( key, {'id': post.get('id', id), 'hash': digest, 'modified': post.get('modified')} )
+			return True
+
+
+	def publish(self, title, content, category, status="publish", tag=""):
+		"""Add a post to the queue of the posts to publish (they are published by flush, at the end of the build)"""
+		self.queue.append( (title, content, category, status, tag) )
+
+
+	def flush(self, jobs=4, force=False):
+		"""Publish the posts of the queue, at most jobs at the same time (the posts that have not changed are skipped, unless force is True)
+		The errors are displayed (a post that cannot be published does not prevent the others to be)
+		Returns the titles of the posts published"""
+		queue, self.queue = self.queue, []
+		if not queue:
+			return []
+		print( Fore.BLUE + "*) Publish " + str(len(queue)) + " post" + ("s" if len(queue)>1 else "") + " to " + self.url + Fore.RESET)
+		# (the authentication and the indexes of the categories are done first, once)
+		try:
+			for category in { post[2] for post in queue }:
+				self.postIndex( category)
+		except (mkcException, requests.RequestException) as err:
+			print( Fore.RED + "The posts cannot be published: " + str(err) + Fore.RESET)
+			return []
+
+		def publishPost( post):
+			try:
+				return post[0], self.createUpdatePost( *post, force=force), None
+			except (mkcException, requests.RequestException) as err:
+				return post[0], False, err
+
+		published = []
+		unchanged = 0
+		from concurrent.futures import ThreadPoolExecutor
+		with ThreadPoolExecutor( max( 1, min( jobs, len(queue) ) ) ) as pool:
+			for title, done, err in pool.map( publishPost, queue):
+				if err is not None:
+					print( Fore.RED + "The post '" + title + "' cannot be published: " + str(err) + Fore.RESET)
+				elif done:
+					published.append( title)
+				else:
+					unchanged += 1
+		if unchanged:
+			print( Fore.BLUE + "  (" + str(unchanged) + " post" + ("s have" if unchanged>1 else " has") + " not changed, not updated)" + Fore.RESET)
+		return published
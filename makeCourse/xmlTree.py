@@ -0,0 +1,138 @@
+"""
+	Tree of the XML files (course file and imported files)
+
+	The files are parsed directly with lxml (iterparse), or with BeautifulSoup (option --parser bs4),
+	and both give the same tree of Node objects (with the subset of the BeautifulSoup API used by the Tag objects)
+"""
+
+import io
+import importlib.util
+from .config import Config
+from .mkcException import mkcException
+from .profiling import span
+
+
+class Comment(str):
+	"""XML comment (in the contents of a Node)"""
+	name = None		# (like BeautifulSoup's comments, it is not a tag)
+
+
+class Node(object):
+	"""XML element
+	- name: name of the tag
+	- attrs: dictionary of the attributes
+	- contents: list of the children, in the order of the file (Node, strings and Comments)
+	"""
+	__slots__ = ('name', 'attrs', 'contents')
+
+	def __init__(self, name, attrs=None, contents=None):
+		self.name = name
+		self.attrs = attrs if attrs is not None else {}
+		self.contents = contents if contents is not None else []
+
+	@property
+	def string(self):
+		"""the only string of the node (same as BeautifulSoup's string: None if the node does not contain exactly one child)"""
+		if len(self.contents) != 1:
+			return None
+		c = self.contents[0]
+		return c.string if isinstance(c, Node) else c
+
+	def get(self, key, default=None):
+		return self.attrs.get(key, default)
+
+	def has_attr(self, key):
+		return key in self.attrs
+
+	def __getitem__(self, key):
+		return self.attrs[key]
+
+	def __setitem__(self, key, value):
+		self.attrs[key] = value
+
+	def __delitem__(self, key):
+		del self.attrs[key]
+
+	def __repr__(self):
+		return '<'+self.name+'>'
+
+
+
+def _string( s):
+	"""string of the tree (the whitespace-only strings are collapsed to a newline or a space, like with BeautifulSoup)"""
+	if s.strip():
+		return s
+	return '\n' if '\n' in s else ' '
+
+
+def _parseLxml( f, encoding):
+	"""parse the file object f with lxml, and return the document Node"""
+	from lxml import etree
+	document = Node('[document]')
+	nodes = {}		# lxml element -> Node (only for the elements whose father is not closed yet)
+	top = []		# elements and comments at the top of the document
+	try:
+		for event, elem in etree.iterparse( f, events=('start', 'end', 'comment'), encoding=encoding, recover=True, remove_blank_text=False):
+			if event == 'start':
+				if elem.getparent() is None:
+					top.append(elem)
+			elif event == 'comment':
+				if elem.getparent() is None:
+					top.append(elem)
+			else:
+				# the element is closed: its text and the text after its children are known
+				node = Node( elem.tag, dict(elem.attrib) )
+				if elem.text:
+					node.contents.append( _string(elem.text) )
+				for child in elem:
+					if child.tag is etree.Comment:
+						node.contents.append( Comment(child.text or '') )
+					elif child.tag is not etree.PI:
+						node.contents.append( nodes.pop(child) )
+					if child.tail:
+						node.contents.append( _string(child.tail) )
+				nodes[elem] = node
+				# free the children (they are not needed anymore)
+				del elem[:]
+	except etree.XMLSyntaxError:
+		# empty (or not valid) file
+		return document
+	for elem in top:
+		if elem.tag is etree.Comment:
+			document.contents.append( Comment(elem.text or '') )
+		elif elem in nodes:
+			document.contents.append( nodes.pop(elem) )
+	return document
+
+
+def _fromBeautifulSoup( tag):
+	"""build the Node corresponding to a BeautifulSoup tag"""
+	from bs4 import Tag, Comment as bsComment
+	contents = []
+	for c in tag.contents:
+		if isinstance(c, Tag):
+			contents.append( _fromBeautifulSoup(c) )
+		elif isinstance(c, bsComment):
+			contents.append( Comment(c) )
+		else:
+			contents.append( str(c) )
+	return Node( tag.name, dict(tag.attrs), contents)
+
+
+def parseFile( fileName, encoding='utf-8'):
+	"""Parse a XML file and return its document Node (whose name is '[document]', like with BeautifulSoup)
+	The parser is lxml, unless BeautifulSoup is asked (option --parser); both need lxml"""
+	parser = getattr( Config.options, 'parser', 'lxml')
+	if importlib.util.find_spec('lxml') is None:
+		raise mkcException( "lxml is required to parse the XML files (pip install lxml)")
+	try:
+		with span( 'parse', fileName):
+			if parser == 'lxml':
+				with open( fileName, 'rb') as f:
+					return _parseLxml( f, encoding)
+			else:
+				from bs4 import BeautifulSoup
+				with io.open( fileName, encoding=encoding) as f:
+					return _fromBeautifulSoup( BeautifulSoup( f, features="xml") )
+	except (IOError, LookupError) as e:
+		raise mkcException( "The file "+fileName+" cannot be read ("+str(e)+")")